@@ -5,14 +5,15 @@ Returns: HTTP response with user data or error
 '''
 
 import json
-import os
-import psycopg2
 from typing import Dict, Any
 
+import db
+
 def escape_sql(value: str) -> str:
     """Escape single quotes for SQL safety"""
     return value.replace("'", "''")
 
+@db.read_your_writes
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     
@@ -22,7 +23,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
+                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Min-Lsn',
                 'Access-Control-Max-Age': '86400'
             },
             'body': '',
@@ -53,8 +54,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     username_esc = escape_sql(username)
     password_esc = escape_sql(password)
     
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
-    conn.autocommit = True
+    conn = db.connect_primary()
     cur = conn.cursor()
     
     try:
@@ -79,6 +79,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 RETURNING id, username, avatar_url, bio, status, is_premium, theme
             """)
             user = cur.fetchone()
+            conn.commit()
             
             return {
                 'statusCode': 200,
@@ -115,6 +116,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 }
             
             cur.execute(f"UPDATE users SET status = 'online', last_seen = CURRENT_TIMESTAMP WHERE id = {user[0]}")
+            conn.commit()
             
             return {
                 'statusCode': 200,
@@ -0,0 +1,264 @@
+"""
+Business: Route reads to replicas and writes to the primary, with read-your-writes by WAL LSN
+Args: DATABASE_URL (primary), DATABASE_REPLICA_URLS (optional, comma-separated replica DSNs)
+Returns: psycopg2 connections; handler responses stamped with the primary LSN after a write
+
+In server mode (server/app.py) the process installs shared pools with use_pools(), and
+connections are borrowed from them instead of opened per request. A batch request binds
+one connection with bind_connection() so every operation in it runs on that connection.
+
+Each cloud function is deployed on its own, so this file is kept identical in every
+backend function directory that uses it; tools/check_copies.py (part of npm run lint)
+fails when the copies differ.
+"""
+
+import contextlib
+import contextvars
+import functools
+import os
+import queue
+import random
+import re
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+import psycopg2
+import psycopg2.extensions
+
+WAL_LSN_HEADER = 'X-Wal-Lsn'
+MIN_LSN_HEADER = 'x-min-lsn'
+LSN_RE = re.compile(r'^[0-9A-Fa-f]{1,8}/[0-9A-Fa-f]{1,8}$')
+POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', '10'))
+
+_written_lsn: contextvars.ContextVar = contextvars.ContextVar('written_lsn', default=None)
+_bound: contextvars.ContextVar = contextvars.ContextVar('bound_connection', default=None)
+_pools: Optional[Dict[str, Any]] = None
+
+
+class PrimaryConnection(psycopg2.extensions.connection):
+    """Remembers the primary WAL position right after each commit"""
+
+    wal_lsn: Optional[str] = None
+
+    def commit(self) -> None:
+        super().commit()
+        cur = self.cursor()
+        try:
+            cur.execute("SELECT pg_current_wal_lsn()::text")
+            self.wal_lsn = cur.fetchone()[0]
+        finally:
+            cur.close()
+        super().commit()
+        _written_lsn.set(self.wal_lsn)
+
+
+class PoolTimeout(psycopg2.OperationalError):
+    """No pooled connection freed up within POOL_TIMEOUT; the server answers 503"""
+
+
+class ConnectionPool:
+    """Thread-safe connection pool that waits up to POOL_TIMEOUT for a free slot when exhausted"""
+
+    def __init__(self, size: int, dsn: str, **kwargs: Any):
+        self.dsn = dsn
+        self._slots = threading.BoundedSemaphore(size)
+        self._idle: queue.LifoQueue = queue.LifoQueue()
+        self._kwargs = kwargs
+
+    def getconn(self):
+        # Bounded so that a stuck pool turns into failed requests rather than a hung server
+        if not self._slots.acquire(timeout=POOL_TIMEOUT):
+            raise PoolTimeout(f'No free database connection within {POOL_TIMEOUT:g}s')
+        try:
+            while True:
+                try:
+                    conn = self._idle.get_nowait()
+                except queue.Empty:
+                    return psycopg2.connect(self.dsn, **self._kwargs)
+                if not conn.closed:
+                    return conn
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn) -> None:
+        try:
+            if conn.closed:
+                return
+            if conn.info.transaction_status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+                conn.close()
+                return
+            if conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+            self._idle.put(conn)
+        except psycopg2.Error:
+            conn.close()
+        finally:
+            self._slots.release()
+
+    def closeall(self) -> None:
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class PooledConnection:
+    """A borrowed pool connection; close() hands it back instead of disconnecting"""
+
+    def __init__(self, pool: ConnectionPool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._conn, name)
+
+    def commit(self) -> None:
+        # The pool may belong to another function's copy of this module, so record here too
+        self._conn.commit()
+        if getattr(self._conn, 'wal_lsn', None):
+            _written_lsn.set(self._conn.wal_lsn)
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._pool.putconn(self._conn)
+            self._conn = None
+
+
+class BoundConnection:
+    """One batch operation's view of the batch connection: close() keeps it open, and in a
+    transactional batch commit() is left to the batch"""
+
+    def __init__(self, conn, transactional: bool):
+        self._conn = conn
+        self._transactional = transactional
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._conn, name)
+
+    def commit(self) -> None:
+        if self._transactional:
+            return
+        self._conn.commit()
+        if getattr(self._conn, 'wal_lsn', None):
+            _written_lsn.set(self._conn.wal_lsn)
+
+    def close(self) -> None:
+        pass
+
+
+@contextlib.contextmanager
+def bind_connection(conn, transactional: bool):
+    token = _bound.set(BoundConnection(conn, transactional))
+    try:
+        yield
+    finally:
+        _bound.reset(token)
+
+
+def create_pools(size: int) -> Dict[str, Any]:
+    return {
+        'size': size,
+        'primary': ConnectionPool(size, os.environ['DATABASE_URL'], connection_factory=PrimaryConnection),
+        'replicas': [ConnectionPool(size, dsn, connect_timeout=2) for dsn in replica_urls()],
+        'other': {},
+        'lock': threading.Lock()
+    }
+
+
+def use_pools(pools: Optional[Dict[str, Any]]) -> None:
+    global _pools
+    _pools = pools
+
+
+def replica_urls() -> List[str]:
+    return [dsn.strip() for dsn in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if dsn.strip()]
+
+
+def min_lsn(event: Dict[str, Any]) -> Optional[str]:
+    for key, value in (event.get('headers') or {}).items():
+        if key.lower() == MIN_LSN_HEADER and value and LSN_RE.match(value.strip()):
+            return value.strip()
+    return None
+
+
+def connect_primary():
+    if _bound.get() is not None:
+        return _bound.get()
+    if _pools:
+        return PooledConnection(_pools['primary'], _pools['primary'].getconn())
+    return psycopg2.connect(os.environ['DATABASE_URL'], connection_factory=PrimaryConnection)
+
+
+def _connect_replica(dsn: str):
+    if _pools:
+        for pool in _pools['replicas']:
+            if pool.dsn == dsn:
+                return PooledConnection(pool, pool.getconn())
+    return psycopg2.connect(dsn, connect_timeout=2)
+
+
+def connect_dsn(dsn: str):
+    """Connection to another database, such as a message shard; pooled in server mode"""
+    if _pools:
+        with _pools['lock']:
+            pool = _pools['other'].get(dsn)
+            if pool is None:
+                pool = _pools['other'][dsn] = ConnectionPool(_pools['size'], dsn)
+        return PooledConnection(pool, pool.getconn())
+    return psycopg2.connect(dsn)
+
+
+def connect_read(event: Dict[str, Any]):
+    """Connect to a replica that has replayed the client's last write, else to the primary"""
+    if _bound.get() is not None:
+        return _bound.get()
+    required = min_lsn(event)
+    replicas = replica_urls()
+    random.shuffle(replicas)
+
+    for dsn in replicas:
+        try:
+            conn = _connect_replica(dsn)
+        except psycopg2.OperationalError:
+            continue
+        if required is None or caught_up(conn, required):
+            return conn
+        conn.close()
+
+    return connect_primary()
+
+
+def caught_up(conn, lsn: str) -> bool:
+    cur = conn.cursor()
+    try:
+        # NULL replay position means the server is not a standby, so it has every write
+        cur.execute("SELECT COALESCE(pg_last_wal_replay_lsn() >= %s::pg_lsn, TRUE)", (lsn,))
+        result = cur.fetchone()[0]
+        conn.rollback()
+        return result
+    finally:
+        cur.close()
+
+
+def read_your_writes(handler: Callable) -> Callable:
+    """Return the primary LSN after a write so the client can send it back as X-Min-Lsn"""
+
+    @functools.wraps(handler)
+    def wrapper(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+        token = _written_lsn.set(None)
+        try:
+            response = handler(event, context)
+            lsn = _written_lsn.get()
+        finally:
+            _written_lsn.reset(token)
+
+        if lsn:
+            headers = dict(response.get('headers') or {})
+            headers[WAL_LSN_HEADER] = lsn
+            headers['Access-Control-Expose-Headers'] = WAL_LSN_HEADER
+            response = {**response, 'headers': headers}
+        return response
+
+    return wrapper
@@ -6,9 +6,149 @@ Returns: HTTP response with groups data
 
 import json
 import os
-import psycopg2
-from typing import Dict, Any
+import re
+from typing import Dict, Any, Optional
 
+import db
+import shards
+
+READ_ACTIONS = {'get_messages'}
+
+# Groups at or above this size are read from a shared tail instead of group_messages
+TAIL_THRESHOLD = int(os.environ.get('GROUP_TAIL_THRESHOLD', '500'))
+TAIL_SIZE = int(os.environ.get('GROUP_TAIL_SIZE', '200'))
+
+# Send interval for users moderation rate-limited or hid (see backend/moderation)
+RATE_LIMIT_SECONDS = int(os.environ.get('MODERATION_RATE_LIMIT_SECONDS', '30'))
+
+MEDIA_SHA256_RE = re.compile(r'[?&]sha256=([0-9a-f]{64})')
+
+def media_voice_duration(cur, voice_url: Any, fallback: Any) -> Any:
+    """Prefer the duration the media store measured over the one the client reported"""
+    match = MEDIA_SHA256_RE.search(voice_url or '')
+    if not match:
+        return fallback
+    cur.execute("SELECT duration_ms FROM media_objects WHERE sha256 = %s", (match.group(1),))
+    row = cur.fetchone()
+    if not row or row[0] is None:
+        return fallback
+    return (row[0] + 500) // 1000
+
+def send_allowed(conn, cur, sender_id: Any) -> bool:
+    """Users the moderation worker rate-limited or hid may send one message per RATE_LIMIT_SECONDS"""
+    # Claiming the send slot is one conditional UPDATE: concurrent sends queue on the row
+    # lock and re-check last_message_at, so only one of them gets it
+    cur.execute("""
+        UPDATE users SET last_message_at = CURRENT_TIMESTAMP
+        WHERE id = %s
+          AND moderation_status <> 'active'
+          AND (last_message_at IS NULL OR last_message_at <= CURRENT_TIMESTAMP - %s * INTERVAL '1 second')
+        RETURNING id
+    """, (sender_id, RATE_LIMIT_SECONDS))
+    if cur.fetchone():
+        conn.commit()
+        return True
+    cur.execute("SELECT moderation_status FROM users WHERE id = %s", (sender_id,))
+    row = cur.fetchone()
+    return not row or row[0] == 'active'
+
+def message_position(shard_conns: list, group_id: Any, message_id: Any) -> Optional[tuple]:
+    """(created_at, id) of a message, looked up on every location since it may not have moved yet"""
+    for shard_conn in shard_conns:
+        shard_cur = shard_conn.cursor()
+        shard_cur.execute("SELECT created_at, id FROM group_messages WHERE id = %s AND group_id = %s",
+                          (message_id, group_id))
+        row = shard_cur.fetchone()
+        shard_cur.close()
+        if row:
+            return row
+    return None
+
+def fetch_messages(cur, shard_conns: list, group_id: Any, limit: Any = None, before: Optional[tuple] = None) -> list:
+    """Read-time fan-in: the group's messages straight from group_messages, oldest first
+
+    With before=(created_at, id) only messages older than that one are read, for paging back.
+    """
+    before_at, before_id = before or (None, None)
+    messages = []
+    for shard_conn in shard_conns:
+        shard_cur = shard_conn.cursor()
+        shard_cur.execute("""
+            SELECT id, sender_id, content, file_url, file_name, created_at, voice_url, voice_duration
+            FROM group_messages
+            WHERE group_id = %(group_id)s
+              AND (%(before_at)s::timestamp IS NULL OR (created_at, id) < (%(before_at)s::timestamp, %(before_id)s::bigint))
+            ORDER BY created_at DESC, id DESC
+            LIMIT %(limit)s
+        """, {'group_id': group_id, 'before_at': before_at, 'before_id': before_id, 'limit': limit})
+        
+        for row in shard_cur.fetchall():
+            messages.append({
+                'id': row[0],
+                'sender_id': row[1],
+                'content': row[2],
+                'file_url': row[3],
+                'file_name': row[4],
+                'created_at': row[5].isoformat(),
+                'voice_url': row[6],
+                'voice_duration': row[7]
+            })
+        shard_cur.close()
+    
+    messages = shards.merge(messages)
+    if limit is not None:
+        messages = messages[-limit:]
+    return shards.attach_senders(cur, messages)
+
+def is_large_group(cur, group_id: Any) -> bool:
+    cur.execute("SELECT member_count FROM groups WHERE id = %s", (group_id,))
+    row = cur.fetchone()
+    return bool(row) and row[0] >= TAIL_THRESHOLD
+
+def rebuild_tail(cur, shard_conns: list, group_id: Any) -> None:
+    """Write the tail on the group's owning shard (shard_conns[0]) from all of its locations"""
+    messages = fetch_messages(cur, shard_conns, group_id, TAIL_SIZE)
+    shard_cur = shard_conns[0].cursor()
+    shard_cur.execute("""
+        INSERT INTO group_message_tails (group_id, messages, last_message_id, updated_at)
+        VALUES (%s, %s::jsonb, %s, CURRENT_TIMESTAMP)
+        ON CONFLICT (group_id) DO UPDATE
+        SET messages = EXCLUDED.messages, last_message_id = EXCLUDED.last_message_id, updated_at = EXCLUDED.updated_at
+    """, (group_id, json.dumps(messages), messages[-1]['id'] if messages else None))
+    shard_cur.close()
+
+def append_to_tail(cur, shard_conns: list, group_id: Any, message: Dict[str, Any]) -> None:
+    """Add one message to a large group's tail, keeping the newest TAIL_SIZE oldest first"""
+    # Sends commit in any order, so place the message by (created_at, id) like fetch_messages
+    # rather than appending it; the subqueries read t.messages, so a send that waited on a
+    # concurrent one re-applies itself to that send's result
+    shard_cur = shard_conns[0].cursor()
+    shard_cur.execute("""
+        UPDATE group_message_tails t
+        SET messages = (
+                SELECT COALESCE(jsonb_agg(elem ORDER BY (elem->>'created_at')::timestamp, (elem->>'id')::bigint), '[]'::jsonb)
+                FROM (
+                    SELECT elem
+                    FROM jsonb_array_elements(t.messages || jsonb_build_array(%(message)s::jsonb)) AS e(elem)
+                    ORDER BY (elem->>'created_at')::timestamp DESC, (elem->>'id')::bigint DESC
+                    LIMIT %(size)s
+                ) newest
+            ),
+            last_message_id = (
+                SELECT (elem->>'id')::bigint
+                FROM jsonb_array_elements(t.messages || jsonb_build_array(%(message)s::jsonb)) AS e(elem)
+                ORDER BY (elem->>'created_at')::timestamp DESC, (elem->>'id')::bigint DESC
+                LIMIT 1
+            ),
+            updated_at = CURRENT_TIMESTAMP
+        WHERE t.group_id = %(group_id)s
+    """, {'message': json.dumps(message), 'size': TAIL_SIZE, 'group_id': group_id})
+    updated = shard_cur.rowcount
+    shard_cur.close()
+    if updated == 0:
+        rebuild_tail(cur, shard_conns, group_id)
+
+@db.read_your_writes
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     
@@ -18,13 +158,16 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
+                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Min-Lsn',
                 'Access-Control-Max-Age': '86400'
             },
             'body': ''
         }
     
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    read_only = method == 'GET' or (
+        method == 'POST' and json.loads(event.get('body') or '{}').get('action') in READ_ACTIONS
+    )
+    conn = db.connect_read(event) if read_only else db.connect_primary()
     cur = conn.cursor()
     
     try:
@@ -115,8 +258,8 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 created_by = body_data.get('created_by')
                 
                 cur.execute("""
-                    INSERT INTO groups (name, description, avatar_url, created_by)
-                    VALUES (%s, %s, %s, %s)
+                    INSERT INTO groups (name, description, avatar_url, created_by, member_count)
+                    VALUES (%s, %s, %s, %s, 1)
                     RETURNING id, name, description, avatar_url, created_at
                 """, (name, description, avatar_url, created_by))
                 
@@ -153,8 +296,24 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     VALUES (%s, %s, %s)
                 """, (group_id, user_id, 'member'))
                 
+                cur.execute("""
+                    UPDATE groups SET member_count = member_count + 1
+                    WHERE id = %s
+                    RETURNING member_count
+                """, (group_id,))
+                row = cur.fetchone()
+                
                 conn.commit()
                 
+                # Build the tail once, as the group crosses into tail delivery
+                if row and row[0] == TAIL_THRESHOLD:
+                    shard_conns = shards.connections(shards.group_key(group_id), conn)
+                    try:
+                        rebuild_tail(cur, shard_conns, group_id)
+                        shard_conns[0].commit()
+                    finally:
+                        shards.release(shard_conns, conn)
+                
                 return {
                     'statusCode': 200,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -167,15 +326,48 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 content = body_data.get('content', '')
                 file_url = body_data.get('file_url')
                 file_name = body_data.get('file_name')
+                voice_url = body_data.get('voice_url')
+                voice_duration = media_voice_duration(cur, voice_url, body_data.get('voice_duration'))
                 
-                cur.execute("""
-                    INSERT INTO group_messages (group_id, sender_id, content, file_url, file_name, voice_url, voice_duration)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s)
-                    RETURNING id, created_at
-                """, (group_id, sender_id, content, file_url, file_name, body_data.get('voice_url'), body_data.get('voice_duration')))
+                if not send_allowed(conn, cur, sender_id):
+                    return {
+                        'statusCode': 429,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Too many messages, try again later'})
+                    }
                 
-                result = cur.fetchone()
-                conn.commit()
+                # New messages always go to the group's current owner
+                shard_conns = shards.connections(shards.group_key(group_id), conn)
+                try:
+                    shard_cur = shard_conns[0].cursor()
+                    shard_cur.execute("""
+                        INSERT INTO group_messages (group_id, sender_id, content, file_url, file_name, voice_url, voice_duration)
+                        VALUES (%s, %s, %s, %s, %s, %s, %s)
+                        RETURNING id, created_at
+                    """, (group_id, sender_id, content, file_url, file_name, voice_url, voice_duration))
+                    
+                    result = shard_cur.fetchone()
+                    shard_cur.close()
+                    
+                    if is_large_group(cur, group_id):
+                        cur.execute("SELECT username, avatar_url FROM users WHERE id = %s", (sender_id,))
+                        sender = cur.fetchone() or (None, None)
+                        append_to_tail(cur, shard_conns, group_id, {
+                            'id': result[0],
+                            'sender_id': sender_id,
+                            'content': content,
+                            'file_url': file_url,
+                            'file_name': file_name,
+                            'created_at': result[1].isoformat(),
+                            'sender_name': sender[0],
+                            'sender_avatar': sender[1],
+                            'voice_url': voice_url,
+                            'voice_duration': voice_duration
+                        })
+                    
+                    shard_conns[0].commit()
+                finally:
+                    shards.release(shard_conns, conn)
                 
                 return {
                     'statusCode': 200,
@@ -189,35 +381,40 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             
             elif action == 'get_messages':
                 group_id = body_data.get('group_id')
+                before_id = body_data.get('before_id')
+                messages = None
+                has_more = False
+                shard_conns = shards.connections(shards.group_key(group_id), conn)
                 
-                cur.execute("""
-                    SELECT gm.id, gm.sender_id, gm.content, gm.file_url, gm.file_name, 
-                           gm.created_at, u.username, u.avatar_url, gm.voice_url, gm.voice_duration
-                    FROM group_messages gm
-                    JOIN users u ON gm.sender_id = u.id
-                    WHERE gm.group_id = %s
-                    ORDER BY gm.created_at ASC
-                """, (group_id,))
-                
-                messages = []
-                for row in cur.fetchall():
-                    messages.append({
-                        'id': row[0],
-                        'sender_id': row[1],
-                        'content': row[2],
-                        'file_url': row[3],
-                        'file_name': row[4],
-                        'created_at': row[5].isoformat(),
-                        'sender_name': row[6],
-                        'sender_avatar': row[7],
-                        'voice_url': row[8],
-                        'voice_duration': row[9]
-                    })
+                try:
+                    if before_id:
+                        # Paging back through history always reads group_messages, a page at a time
+                        position = message_position(shard_conns, group_id, before_id)
+                        messages = fetch_messages(cur, shard_conns, group_id, TAIL_SIZE, position) if position else []
+                        has_more = len(messages) == TAIL_SIZE
+                    
+                    # Large groups: every member's poll reads one shared row instead of group_messages
+                    elif is_large_group(cur, group_id):
+                        shard_cur = shard_conns[0].cursor()
+                        shard_cur.execute("SELECT messages FROM group_message_tails WHERE group_id = %s", (group_id,))
+                        tail = shard_cur.fetchone()
+                        shard_cur.close()
+                        if tail:
+                            messages = tail[0]
+                        else:
+                            messages = fetch_messages(cur, shard_conns, group_id, TAIL_SIZE)
+                        # The tail holds only the newest messages; older ones are a before_id away
+                        has_more = len(messages) >= TAIL_SIZE
+                    
+                    if messages is None:
+                        messages = fetch_messages(cur, shard_conns, group_id)
+                finally:
+                    shards.release(shard_conns, conn)
                 
                 return {
                     'statusCode': 200,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'messages': messages})
+                    'body': json.dumps({'messages': messages, 'has_more': has_more})
                 }
         
         return {
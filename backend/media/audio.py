@@ -0,0 +1,158 @@
+"""
+Business: Read the duration of an uploaded voice message without decoding it
+Args: path to a WebM (MediaRecorder), Ogg (Opus/Vorbis) or WAV file
+Returns: duration in milliseconds, or None when the container is not recognised
+"""
+
+import struct
+from typing import BinaryIO, Optional, Tuple
+
+SEGMENT = 0x18538067
+INFO = 0x1549A966
+CLUSTER = 0x1F43B675
+BLOCK_GROUP = 0xA0
+TIMECODE_SCALE = 0x2AD7B1
+DURATION = 0x4489
+CLUSTER_TIMECODE = 0xE7
+SIMPLE_BLOCK = 0xA3
+BLOCK = 0xA1
+
+EBML_DESCEND = {SEGMENT, INFO, CLUSTER, BLOCK_GROUP}
+
+OGG_TAIL = 64 * 1024
+
+
+def probe_duration_ms(path: str) -> Optional[int]:
+    try:
+        with open(path, 'rb') as f:
+            magic = f.read(4)
+            f.seek(0)
+            if magic == b'\x1a\x45\xdf\xa3':
+                return _webm_duration_ms(f)
+            if magic == b'OggS':
+                return _ogg_duration_ms(f)
+            if magic == b'RIFF':
+                return _wav_duration_ms(f)
+    except (struct.error, ValueError, OSError):
+        # Truncated or malformed containers just have no known duration
+        return None
+    return None
+
+
+def _read_vint(f: BinaryIO, keep_marker: bool) -> Tuple[Optional[int], int]:
+    first = f.read(1)
+    if not first:
+        return None, 0
+    b = first[0]
+    length = 1
+    mask = 0x80
+    while length <= 8 and not b & mask:
+        length += 1
+        mask >>= 1
+    if length > 8:
+        return None, 0
+    value = b if keep_marker else b & (mask - 1)
+    rest = f.read(length - 1)
+    if len(rest) < length - 1:
+        return None, 0
+    for byte in rest:
+        value = (value << 8) | byte
+    if not keep_marker and value == (1 << (7 * length)) - 1:
+        # all ones: unknown size, as MediaRecorder writes for Segment and Cluster
+        return -1, length
+    return value, length
+
+
+def _webm_duration_ms(f: BinaryIO) -> Optional[int]:
+    scale = 1_000_000
+    header_duration = None
+    cluster_tc = 0
+    max_tc = None
+
+    while True:
+        element_id, _ = _read_vint(f, keep_marker=True)
+        if element_id is None:
+            break
+        size, _ = _read_vint(f, keep_marker=False)
+        if size is None:
+            break
+
+        if element_id in EBML_DESCEND:
+            continue
+        if size < 0:
+            break
+
+        if element_id == TIMECODE_SCALE:
+            scale = int.from_bytes(f.read(size), 'big')
+        elif element_id == DURATION:
+            raw = f.read(size)
+            header_duration = struct.unpack('>f' if size == 4 else '>d', raw)[0]
+        elif element_id == CLUSTER_TIMECODE:
+            cluster_tc = int.from_bytes(f.read(size), 'big')
+        elif element_id in (SIMPLE_BLOCK, BLOCK):
+            start = f.tell()
+            _read_vint(f, keep_marker=False)
+            rel = struct.unpack('>h', f.read(2))[0]
+            f.seek(start + size)
+            tc = cluster_tc + rel
+            if max_tc is None or tc > max_tc:
+                max_tc = tc
+        else:
+            f.seek(size, 1)
+
+    if header_duration:
+        return int(header_duration * scale / 1_000_000)
+    if max_tc is not None:
+        return int(max_tc * scale / 1_000_000)
+    return None
+
+
+def _ogg_duration_ms(f: BinaryIO) -> Optional[int]:
+    head = f.read(27)
+    if len(head) < 27:
+        return None
+    segments = head[26]
+    f.read(segments)
+    packet = f.read(64)
+
+    pre_skip = 0
+    if packet.startswith(b'OpusHead'):
+        rate = 48000
+        pre_skip = struct.unpack('<H', packet[10:12])[0]
+    elif packet.startswith(b'\x01vorbis'):
+        rate = struct.unpack('<I', packet[12:16])[0]
+    else:
+        return None
+
+    f.seek(0, 2)
+    size = f.tell()
+    f.seek(max(0, size - OGG_TAIL))
+    tail = f.read()
+    pos = tail.rfind(b'OggS')
+    if pos < 0 or pos + 14 > len(tail):
+        return None
+    granule = struct.unpack('<q', tail[pos + 6:pos + 14])[0]
+    if granule < 0 or not rate:
+        return None
+    return int(max(0, granule - pre_skip) * 1000 / rate)
+
+
+def _wav_duration_ms(f: BinaryIO) -> Optional[int]:
+    header = f.read(12)
+    if len(header) < 12 or header[8:12] != b'WAVE':
+        return None
+    byte_rate = None
+    while True:
+        chunk = f.read(8)
+        if len(chunk) < 8:
+            return None
+        chunk_id, chunk_size = chunk[:4], struct.unpack('<I', chunk[4:])[0]
+        if chunk_id == b'fmt ':
+            fmt = f.read(chunk_size)
+            byte_rate = struct.unpack('<I', fmt[8:12])[0]
+        elif chunk_id == b'data':
+            if not byte_rate:
+                return None
+            return int(chunk_size * 1000 / byte_rate)
+        else:
+            f.seek(chunk_size + (chunk_size & 1), 1)
@@ -0,0 +1,391 @@
+"""
+Business: Content-addressed media store for attachments, avatars and voice messages
+Args: event with httpMethod, body, headers, queryStringParameters; context with request_id
+Returns: HTTP response with upload status or (ranged) file bytes
+"""
+
+import base64
+import binascii
+import hashlib
+import json
+import os
+import re
+import tempfile
+import uuid
+from typing import Dict, Any, Optional, Tuple
+from urllib.parse import quote
+
+import psycopg2
+
+from audio import probe_duration_ms
+from storage import get_storage
+
+MAX_CHUNK_SIZE = 4 * 1024 * 1024
+MAX_UPLOAD_SIZE = 100 * 1024 * 1024
+MAX_RANGE_SIZE = 2 * 1024 * 1024
+MAX_PARTS = 10000
+PRESIGNED_URL_EXPIRES = 3600
+
+# Served inline; everything else (HTML, SVG, PDF, ...) is a download, so an uploaded page
+# can never run script on this origin
+INLINE_TYPES = {
+    'image/png', 'image/jpeg', 'image/gif', 'image/webp', 'image/avif', 'image/bmp',
+    'audio/webm', 'audio/ogg', 'audio/mpeg', 'audio/mp4', 'audio/aac', 'audio/wav', 'audio/x-wav', 'audio/flac'
+}
+
+SHA256_RE = re.compile(r'^[0-9a-f]{64}$')
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+JSON_HEADERS = {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+
+
+def json_response(status: int, payload: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        'statusCode': status,
+        'headers': JSON_HEADERS,
+        'body': json.dumps(payload),
+        'isBase64Encoded': False
+    }
+
+
+def object_key(sha256: str) -> str:
+    return f'objects/{sha256[:2]}/{sha256[2:4]}/{sha256}'
+
+
+def part_key(upload_id: str, index: int) -> str:
+    return f'uploads/{upload_id}/{index:05d}'
+
+
+def media_url(sha256: str, file_name: Optional[str] = None) -> str:
+    """Objects are shared by content, so the name each uploader gave travels in the URL"""
+    url = f"{os.environ.get('MEDIA_PUBLIC_URL', '')}?sha256={sha256}"
+    return f"{url}&name={quote(file_name, safe='')}" if file_name else url
+
+
+def content_disposition(content_type: str, file_name: Optional[str]) -> str:
+    base_type = content_type.split(';')[0].strip().lower()
+    disposition = 'inline' if base_type in INLINE_TYPES else 'attachment'
+    name = os.path.basename((file_name or '').replace('\\', '/')).strip()
+    if not name:
+        return disposition
+    fallback = ''.join(c if 32 <= ord(c) < 127 and c not in '"\\' else '_' for c in name)
+    return f"{disposition}; filename=\"{fallback}\"; filename*=UTF-8''{quote(name, safe='')}"
+
+
+def duration_seconds(duration_ms: Optional[int]) -> Optional[int]:
+    if duration_ms is None:
+        return None
+    return (duration_ms + 500) // 1000
+
+
+def get_header(event: Dict[str, Any], name: str) -> Optional[str]:
+    for key, value in (event.get('headers') or {}).items():
+        if key.lower() == name:
+            return value
+    return None
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """Return (start, end) inclusive, or None to serve the whole object; raises ValueError if unsatisfiable"""
+    if not header:
+        return None
+    match = RANGE_RE.match(header.strip())
+    if not match or (not match.group(1) and not match.group(2)):
+        return None
+    if match.group(1):
+        start = int(match.group(1))
+        end = int(match.group(2)) if match.group(2) else size - 1
+    else:
+        start = max(0, size - int(match.group(2)))
+        end = size - 1
+    if start >= size or start > end:
+        raise ValueError('Range not satisfiable')
+    end = min(end, size - 1, start + MAX_RANGE_SIZE - 1)
+    return start, end
+
+
+def decode_data(value: Any) -> Optional[bytes]:
+    """Decode a base64 payload from the request body; None if it is not valid base64"""
+    try:
+        return base64.b64decode(value or '', validate=True)
+    except (binascii.Error, TypeError, ValueError):
+        return None
+
+
+def object_info(cur, sha256: str) -> Optional[Dict[str, Any]]:
+    cur.execute("""
+        SELECT sha256, size, content_type, storage_key, duration_ms
+        FROM media_objects
+        WHERE sha256 = %s
+    """, (sha256,))
+    row = cur.fetchone()
+    if not row:
+        return None
+    return {
+        'sha256': row[0],
+        'size': row[1],
+        'content_type': row[2],
+        'storage_key': row[3],
+        'duration_ms': row[4]
+    }
+
+
+def stored_payload(info: Dict[str, Any], exists: bool, file_name: Optional[str] = None) -> Dict[str, Any]:
+    return {
+        'success': True,
+        'exists': exists,
+        'sha256': info['sha256'],
+        'url': media_url(info['sha256'], file_name),
+        'size': info['size'],
+        'content_type': info['content_type'],
+        'voice_duration': duration_seconds(info['duration_ms'])
+    }
+
+
+def store_file(cur, storage, path: str, sha256: str, size: int, content_type: str,
+               kind: str, user_id: Any) -> Tuple[Dict[str, Any], bool]:
+    """Put an assembled temp file under its content address; identical bytes are kept once"""
+    info = object_info(cur, sha256)
+    if info:
+        cur.execute("UPDATE media_objects SET upload_count = upload_count + 1 WHERE sha256 = %s", (sha256,))
+        return info, True
+
+    duration_ms = None
+    if kind == 'voice' or content_type.startswith('audio/'):
+        duration_ms = probe_duration_ms(path)
+
+    key = object_key(sha256)
+    storage.put_file(key, path, content_type)
+    cur.execute("""
+        INSERT INTO media_objects (sha256, size, content_type, storage_key, duration_ms, created_by)
+        VALUES (%s, %s, %s, %s, %s, %s)
+        ON CONFLICT (sha256) DO UPDATE SET upload_count = media_objects.upload_count + 1
+    """, (sha256, size, content_type, key, duration_ms, user_id))
+    return {
+        'sha256': sha256,
+        'size': size,
+        'content_type': content_type,
+        'storage_key': key,
+        'duration_ms': duration_ms
+    }, False
+
+
+def serve_object(event: Dict[str, Any], cur, storage, sha256: str, file_name: Optional[str]) -> Dict[str, Any]:
+    info = object_info(cur, sha256)
+    if not info:
+        return json_response(404, {'error': 'Not found'})
+
+    size = info['size']
+    etag = f'"{sha256}"'
+    # The stored type is whatever the uploader claimed: never let the browser sniff or render it
+    disposition = content_disposition(info['content_type'], file_name)
+    headers = {
+        'Content-Type': info['content_type'],
+        'Content-Disposition': disposition,
+        'X-Content-Type-Options': 'nosniff',
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Expose-Headers': 'Content-Range, Content-Length, Accept-Ranges, ETag, Content-Disposition',
+        'Accept-Ranges': 'bytes',
+        'Cache-Control': 'public, max-age=31536000, immutable',
+        'ETag': etag
+    }
+
+    if get_header(event, 'if-none-match') == etag:
+        return {'statusCode': 304, 'headers': headers, 'body': '', 'isBase64Encoded': False}
+
+    try:
+        byte_range = parse_range(get_header(event, 'range'), size)
+    except ValueError:
+        headers['Content-Range'] = f'bytes */{size}'
+        return {'statusCode': 416, 'headers': headers, 'body': '', 'isBase64Encoded': False}
+
+    if byte_range is None and size > MAX_RANGE_SIZE:
+        # A plain GET (an <img>, a link) must get the whole object: S3 hands it out directly,
+        # local storage (development and server mode) sends it in full below
+        url = storage.presigned_url(info['storage_key'], info['content_type'], disposition, PRESIGNED_URL_EXPIRES)
+        if url:
+            return {
+                'statusCode': 302,
+                'headers': {'Location': url, 'Access-Control-Allow-Origin': '*'},
+                'body': '',
+                'isBase64Encoded': False
+            }
+
+    if byte_range:
+        start, end = byte_range
+        data = storage.read_range(info['storage_key'], start, end)
+        headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+        status = 206
+    else:
+        data = storage.read_range(info['storage_key'], 0, size - 1) if size else b''
+        status = 200
+
+    headers['Content-Length'] = str(len(data))
+    return {
+        'statusCode': status,
+        'headers': headers,
+        'body': base64.b64encode(data).decode('ascii'),
+        'isBase64Encoded': True
+    }
+
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    method: str = event.get('httpMethod', 'GET')
+
+    if method == 'OPTIONS':
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, Range, If-None-Match',
+                'Access-Control-Max-Age': '86400'
+            },
+            'body': ''
+        }
+
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    cur = conn.cursor()
+    storage = get_storage()
+
+    try:
+        if method == 'GET':
+            params = event.get('queryStringParameters') or {}
+            sha256 = (params.get('sha256') or '').lower()
+
+            if not SHA256_RE.match(sha256):
+                return json_response(400, {'error': 'sha256 required'})
+
+            return serve_object(event, cur, storage, sha256, params.get('name'))
+
+        elif method == 'POST':
+            body_data = json.loads(event.get('body', '{}'))
+            action = body_data.get('action')
+
+            if action == 'init_upload':
+                sha256 = (body_data.get('sha256') or '').lower()
+
+                # The client may hash before sending; a known file is never transferred again
+                if SHA256_RE.match(sha256):
+                    info = object_info(cur, sha256)
+                    if info:
+                        return json_response(200, stored_payload(info, True, body_data.get('file_name')))
+
+                upload_id = str(uuid.uuid4())
+                cur.execute("""
+                    INSERT INTO media_uploads (id, user_id, file_name, content_type, kind)
+                    VALUES (%s, %s, %s, %s, %s)
+                """, (
+                    upload_id,
+                    body_data.get('user_id'),
+                    body_data.get('file_name'),
+                    body_data.get('content_type') or 'application/octet-stream',
+                    'voice' if body_data.get('kind') == 'voice' else 'file'
+                ))
+                conn.commit()
+
+                return json_response(200, {
+                    'success': True,
+                    'exists': False,
+                    'upload_id': upload_id,
+                    'chunk_size': MAX_CHUNK_SIZE
+                })
+
+            elif action == 'upload_chunk':
+                upload_id = body_data.get('upload_id')
+                index = body_data.get('index')
+
+                if not isinstance(index, int) or not 0 <= index < MAX_PARTS:
+                    return json_response(400, {'error': 'Invalid chunk index'})
+
+                data = decode_data(body_data.get('data'))
+                if data is None:
+                    return json_response(400, {'error': 'data must be base64'})
+                if not data or len(data) > MAX_CHUNK_SIZE:
+                    return json_response(400, {'error': 'Chunk must be 1 byte to 4 MB'})
+
+                cur.execute("""
+                    UPDATE media_uploads SET bytes_received = bytes_received + %s
+                    WHERE id = %s
+                    RETURNING bytes_received
+                """, (len(data), upload_id))
+                row = cur.fetchone()
+
+                if not row:
+                    return json_response(404, {'error': 'Upload not found'})
+                if row[0] > MAX_UPLOAD_SIZE:
+                    conn.rollback()
+                    return json_response(413, {'error': 'File too large'})
+
+                storage.put_bytes(part_key(upload_id, index), data)
+                conn.commit()
+
+                return json_response(200, {'success': True, 'index': index})
+
+            elif action == 'complete_upload':
+                upload_id = body_data.get('upload_id')
+                parts = body_data.get('parts')
+
+                if not isinstance(parts, int) or not 0 < parts <= MAX_PARTS:
+                    return json_response(400, {'error': 'parts required'})
+
+                cur.execute("""
+                    SELECT user_id, content_type, kind, file_name FROM media_uploads
+                    WHERE id = %s FOR UPDATE
+                """, (upload_id,))
+                upload = cur.fetchone()
+
+                if not upload:
+                    return json_response(404, {'error': 'Upload not found'})
+
+                digest = hashlib.sha256()
+                size = 0
+                with tempfile.NamedTemporaryFile(suffix='.part') as tmp:
+                    try:
+                        for index in range(parts):
+                            for chunk in storage.iter_object(part_key(upload_id, index)):
+                                digest.update(chunk)
+                                tmp.write(chunk)
+                                size += len(chunk)
+                    except FileNotFoundError:
+                        conn.rollback()
+                        return json_response(400, {'error': f'Missing chunk {index}'})
+                    tmp.flush()
+
+                    info, existed = store_file(
+                        cur, storage, tmp.name, digest.hexdigest(), size,
+                        upload[1], upload[2], upload[0]
+                    )
+
+                cur.execute("DELETE FROM media_uploads WHERE id = %s", (upload_id,))
+                conn.commit()
+                storage.delete_prefix(f'uploads/{upload_id}')
+
+                return json_response(200, stored_payload(info, existed, upload[3]))
+
+            elif action == 'upload':
+                data = decode_data(body_data.get('data'))
+                if data is None:
+                    return json_response(400, {'error': 'data must be base64'})
+                if not data:
+                    return json_response(400, {'error': 'data required'})
+                if len(data) > MAX_CHUNK_SIZE:
+                    return json_response(413, {'error': 'Use chunked upload for files over 4 MB'})
+
+                with tempfile.NamedTemporaryFile(suffix='.part') as tmp:
+                    tmp.write(data)
+                    tmp.flush()
+                    info, existed = store_file(
+                        cur, storage, tmp.name, hashlib.sha256(data).hexdigest(), len(data),
+                        body_data.get('content_type') or 'application/octet-stream',
+                        body_data.get('kind', 'file'), body_data.get('user_id')
+                    )
+                conn.commit()
+
+                return json_response(200, stored_payload(info, existed, body_data.get('file_name')))
+
+        return json_response(405, {'error': 'Method not allowed'})
+
+    finally:
+        cur.close()
+        conn.close()
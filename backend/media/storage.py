@@ -0,0 +1,125 @@
+"""
+Business: Blob storage backends for the media store (local filesystem or S3-compatible)
+Args: MEDIA_STORAGE=local|s3; MEDIA_ROOT for local; S3_BUCKET, S3_ENDPOINT_URL for s3
+Returns: Storage object with put_file, put_bytes, iter_object, read_range, exists, delete, presigned_url
+"""
+
+import os
+import shutil
+from typing import Iterator, Optional
+
+CHUNK_SIZE = 64 * 1024
+
+
+class LocalStorage:
+    def __init__(self, root: str):
+        self.root = root
+
+    def _path(self, key: str) -> str:
+        path = os.path.normpath(os.path.join(self.root, key))
+        if not path.startswith(os.path.normpath(self.root) + os.sep):
+            raise ValueError('Invalid storage key')
+        return path
+
+    def put_file(self, key: str, src_path: str, content_type: str) -> None:
+        dst = self._path(key)
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        tmp = dst + '.tmp'
+        shutil.copyfile(src_path, tmp)
+        os.replace(tmp, dst)
+
+    def put_bytes(self, key: str, data: bytes) -> None:
+        dst = self._path(key)
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        with open(dst, 'wb') as f:
+            f.write(data)
+
+    def iter_object(self, key: str) -> Iterator[bytes]:
+        with open(self._path(key), 'rb') as f:
+            while True:
+                chunk = f.read(CHUNK_SIZE)
+                if not chunk:
+                    return
+                yield chunk
+
+    def read_range(self, key: str, start: int, end: int) -> bytes:
+        with open(self._path(key), 'rb') as f:
+            f.seek(start)
+            return f.read(end - start + 1)
+
+    def presigned_url(self, key: str, content_type: str, disposition: str, expires: int) -> Optional[str]:
+        return None
+
+    def exists(self, key: str) -> bool:
+        return os.path.exists(self._path(key))
+
+    def delete(self, key: str) -> None:
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def delete_prefix(self, prefix: str) -> None:
+        shutil.rmtree(self._path(prefix), ignore_errors=True)
+
+
+class S3Storage:
+    def __init__(self, bucket: str, endpoint_url: Optional[str] = None):
+        import boto3
+        self.bucket = bucket
+        self.client = boto3.client('s3', endpoint_url=endpoint_url)
+
+    def put_file(self, key: str, src_path: str, content_type: str) -> None:
+        # upload_file switches to multipart for large files, so memory stays flat
+        self.client.upload_file(src_path, self.bucket, key, ExtraArgs={'ContentType': content_type})
+
+    def put_bytes(self, key: str, data: bytes) -> None:
+        self.client.put_object(Bucket=self.bucket, Key=key, Body=data)
+
+    def iter_object(self, key: str) -> Iterator[bytes]:
+        try:
+            body = self.client.get_object(Bucket=self.bucket, Key=key)['Body']
+        except self.client.exceptions.NoSuchKey:
+            raise FileNotFoundError(key)
+        try:
+            for chunk in body.iter_chunks(CHUNK_SIZE):
+                yield chunk
+        finally:
+            body.close()
+
+    def read_range(self, key: str, start: int, end: int) -> bytes:
+        obj = self.client.get_object(Bucket=self.bucket, Key=key, Range=f'bytes={start}-{end}')
+        return obj['Body'].read()
+
+    def presigned_url(self, key: str, content_type: str, disposition: str, expires: int) -> Optional[str]:
+        return self.client.generate_presigned_url('get_object', Params={
+            'Bucket': self.bucket,
+            'Key': key,
+            'ResponseContentType': content_type,
+            'ResponseContentDisposition': disposition,
+            'ResponseCacheControl': 'public, max-age=31536000, immutable'
+        }, ExpiresIn=expires)
+
+    def exists(self, key: str) -> bool:
+        from botocore.exceptions import ClientError
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=key)
+            return True
+        except ClientError:
+            return False
+
+    def delete(self, key: str) -> None:
+        self.client.delete_object(Bucket=self.bucket, Key=key)
+
+    def delete_prefix(self, prefix: str) -> None:
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix.rstrip('/') + '/'):
+            keys = [{'Key': obj['Key']} for obj in page.get('Contents', [])]
+            if keys:
+                self.client.delete_objects(Bucket=self.bucket, Delete={'Objects': keys})
+
+
+def get_storage():
+    if os.environ.get('MEDIA_STORAGE', 'local') == 's3':
+        return S3Storage(os.environ['S3_BUCKET'], os.environ.get('S3_ENDPOINT_URL'))
+    return LocalStorage(os.environ.get('MEDIA_ROOT', '/tmp/media'))
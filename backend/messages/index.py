@@ -6,9 +6,47 @@ Returns: HTTP response with messages or success status
 
 import json
 import os
-import psycopg2
+import re
 from typing import Dict, Any
 
+import db
+import shards
+
+MEDIA_SHA256_RE = re.compile(r'[?&]sha256=([0-9a-f]{64})')
+
+# Send interval for users moderation rate-limited or hid (see backend/moderation)
+RATE_LIMIT_SECONDS = int(os.environ.get('MODERATION_RATE_LIMIT_SECONDS', '30'))
+
+def media_voice_duration(cur, voice_url: Any, fallback: Any) -> Any:
+    """Prefer the duration the media store measured over the one the client reported"""
+    match = MEDIA_SHA256_RE.search(voice_url or '')
+    if not match:
+        return fallback
+    cur.execute("SELECT duration_ms FROM media_objects WHERE sha256 = %s", (match.group(1),))
+    row = cur.fetchone()
+    if not row or row[0] is None:
+        return fallback
+    return (row[0] + 500) // 1000
+
+def send_allowed(conn, cur, sender_id: Any) -> bool:
+    """Users the moderation worker rate-limited or hid may send one message per RATE_LIMIT_SECONDS"""
+    # Claiming the send slot is one conditional UPDATE: concurrent sends queue on the row
+    # lock and re-check last_message_at, so only one of them gets it
+    cur.execute("""
+        UPDATE users SET last_message_at = CURRENT_TIMESTAMP
+        WHERE id = %s
+          AND moderation_status <> 'active'
+          AND (last_message_at IS NULL OR last_message_at <= CURRENT_TIMESTAMP - %s * INTERVAL '1 second')
+        RETURNING id
+    """, (sender_id, RATE_LIMIT_SECONDS))
+    if cur.fetchone():
+        conn.commit()
+        return True
+    cur.execute("SELECT moderation_status FROM users WHERE id = %s", (sender_id,))
+    row = cur.fetchone()
+    return not row or row[0] == 'active'
+
+@db.read_your_writes
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     
@@ -19,13 +57,13 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
+                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Min-Lsn',
                 'Access-Control-Max-Age': '86400'
             },
             'body': ''
         }
     
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn = db.connect_read(event) if method == 'GET' else db.connect_primary()
     cur = conn.cursor()
     
     try:
@@ -41,32 +79,38 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'body': json.dumps({'error': 'user_id and contact_id required'})
                 }
             
-            cur.execute("""
-                SELECT m.id, m.sender_id, m.receiver_id, m.content, m.file_url, m.file_name, 
-                       m.is_read, m.created_at, u.username, u.avatar_url, m.voice_url, m.voice_duration
-                FROM messages m
-                JOIN users u ON m.sender_id = u.id
-                WHERE (m.sender_id = %s AND m.receiver_id = %s) 
-                   OR (m.sender_id = %s AND m.receiver_id = %s)
-                ORDER BY m.created_at ASC
-            """, (user_id, contact_id, contact_id, user_id))
-            
             messages = []
-            for row in cur.fetchall():
-                messages.append({
-                    'id': row[0],
-                    'sender_id': row[1],
-                    'receiver_id': row[2],
-                    'content': row[3],
-                    'file_url': row[4],
-                    'file_name': row[5],
-                    'is_read': row[6],
-                    'created_at': row[7].isoformat(),
-                    'sender_name': row[8],
-                    'sender_avatar': row[9],
-                    'voice_url': row[10] if len(row) > 10 else None,
-                    'voice_duration': row[11] if len(row) > 11 else None
-                })
+            shard_conns = shards.connections(shards.dm_key(user_id, contact_id), conn)
+            try:
+                for shard_conn in shard_conns:
+                    shard_cur = shard_conn.cursor()
+                    shard_cur.execute("""
+                        SELECT id, sender_id, receiver_id, content, file_url, file_name, 
+                               is_read, created_at, voice_url, voice_duration
+                        FROM messages
+                        WHERE (sender_id = %s AND receiver_id = %s) 
+                           OR (sender_id = %s AND receiver_id = %s)
+                        ORDER BY created_at ASC
+                    """, (user_id, contact_id, contact_id, user_id))
+                    
+                    for row in shard_cur.fetchall():
+                        messages.append({
+                            'id': row[0],
+                            'sender_id': row[1],
+                            'receiver_id': row[2],
+                            'content': row[3],
+                            'file_url': row[4],
+                            'file_name': row[5],
+                            'is_read': row[6],
+                            'created_at': row[7].isoformat(),
+                            'voice_url': row[8],
+                            'voice_duration': row[9]
+                        })
+                    shard_cur.close()
+            finally:
+                shards.release(shard_conns, conn)
+            
+            messages = shards.attach_senders(cur, shards.merge(messages))
             
             return {
                 'statusCode': 200,
@@ -94,14 +138,30 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         'body': json.dumps({'error': 'sender_id and receiver_id required'})
                     }
                 
-                cur.execute("""
-                    INSERT INTO messages (sender_id, receiver_id, content, file_url, file_name, voice_url, voice_duration)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s)
-                    RETURNING id, created_at
-                """, (sender_id, receiver_id, content, file_url, file_name, voice_url, voice_duration))
+                if not send_allowed(conn, cur, sender_id):
+                    return {
+                        'statusCode': 429,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Too many messages, try again later'})
+                    }
+                
+                voice_duration = media_voice_duration(cur, voice_url, voice_duration)
                 
-                result = cur.fetchone()
-                conn.commit()
+                # New messages always go to the conversation's current owner
+                shard_conn = shards.owner_connection(shards.dm_key(sender_id, receiver_id), conn)
+                try:
+                    shard_cur = shard_conn.cursor()
+                    shard_cur.execute("""
+                        INSERT INTO messages (sender_id, receiver_id, content, file_url, file_name, voice_url, voice_duration)
+                        VALUES (%s, %s, %s, %s, %s, %s, %s)
+                        RETURNING id, created_at
+                    """, (sender_id, receiver_id, content, file_url, file_name, voice_url, voice_duration))
+                    
+                    result = shard_cur.fetchone()
+                    shard_conn.commit()
+                    shard_cur.close()
+                finally:
+                    shards.release([shard_conn], conn)
                 
                 return {
                     'statusCode': 200,
@@ -115,12 +175,31 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             
             elif action == 'mark_read':
                 message_ids = body_data.get('message_ids', [])
-                if message_ids:
-                    cur.execute(
-                        "UPDATE messages SET is_read = TRUE WHERE id = ANY(%s)",
-                        (message_ids,)
-                    )
-                    conn.commit()
+                user_id = body_data.get('user_id')
+                contact_id = body_data.get('contact_id')
+                
+                if message_ids or (user_id and contact_id):
+                    # Ids are unique across shards, so without the conversation every shard is asked
+                    key = shards.dm_key(user_id, contact_id) if user_id and contact_id else None
+                    shard_conns = shards.connections(key, conn)
+                    try:
+                        for shard_conn in shard_conns:
+                            shard_cur = shard_conn.cursor()
+                            if message_ids:
+                                shard_cur.execute(
+                                    "UPDATE messages SET is_read = TRUE WHERE id = ANY(%s)",
+                                    (message_ids,)
+                                )
+                            else:
+                                # Opening a chat: everything the contact sent is now read
+                                shard_cur.execute("""
+                                    UPDATE messages SET is_read = TRUE
+                                    WHERE sender_id = %s AND receiver_id = %s AND is_read IS NOT TRUE
+                                """, (contact_id, user_id))
+                            shard_conn.commit()
+                            shard_cur.close()
+                    finally:
+                        shards.release(shard_conns, conn)
                 
                 return {
                     'statusCode': 200,
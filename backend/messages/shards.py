@@ -0,0 +1,145 @@
+"""
+Business: Place each conversation's messages on one of several Postgres shards by consistent hashing
+Args: MESSAGE_SHARD_URLS="1=dsn,2=dsn" (the ring); MESSAGE_SHARD_URLS_PREVIOUS (the ring being left)
+Returns: connections to the shard that owns a conversation, plus its previous owner while it moves
+
+Without MESSAGE_SHARD_URLS everything stays in the main database. A conversation is a user
+pair (dm:<low>:<high>) or a group (group:<id>). While a rebalance runs, writes go to the new
+owner and reads merge the new and previous owners, so nothing is missed mid-move; see
+tools/rebalance_shards.py. Shard schemas come from tools/shard_schema.sql and give message ids
+a per-shard prefix, so ids stay unique when rows move between shards.
+
+Kept identical in messages/ and groups/, which are deployed separately; tools/check_copies.py
+checks that.
+"""
+
+import bisect
+import functools
+import hashlib
+import os
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import db
+
+VNODES = 128
+
+
+def parse_shards(value: str) -> Dict[int, str]:
+    shards = {}
+    for item in value.split(','):
+        if item.strip():
+            number, _, dsn = item.strip().partition('=')
+            shards[int(number)] = dsn.strip()
+    return shards
+
+
+def hash_point(value: str) -> int:
+    return int.from_bytes(hashlib.md5(value.encode('utf-8')).digest()[:8], 'big')
+
+
+class Ring:
+    """Consistent hash ring; adding a shard only moves the keys that land on its points"""
+
+    def __init__(self, shards: Dict[int, str]):
+        self.shards = shards
+        points = sorted((hash_point(f'{number}#{vnode}'), number) for number in shards for vnode in range(VNODES))
+        self._hashes = [point[0] for point in points]
+        self._owners = [point[1] for point in points]
+
+    def owner(self, key: str) -> int:
+        index = bisect.bisect(self._hashes, hash_point(key)) % len(self._hashes)
+        return self._owners[index]
+
+
+@functools.lru_cache(maxsize=4)
+def _rings(current: str, previous: str) -> Tuple[Optional[Ring], Optional[Ring]]:
+    current_shards = parse_shards(current)
+    previous_shards = parse_shards(previous)
+    return (Ring(current_shards) if current_shards else None,
+            Ring(previous_shards) if previous_shards else None)
+
+
+def rings() -> Tuple[Optional[Ring], Optional[Ring]]:
+    return _rings(os.environ.get('MESSAGE_SHARD_URLS', ''), os.environ.get('MESSAGE_SHARD_URLS_PREVIOUS', ''))
+
+
+def dm_key(user_a: Any, user_b: Any) -> str:
+    low, high = sorted((int(user_a), int(user_b)))
+    return f'dm:{low}:{high}'
+
+
+def group_key(group_id: Any) -> str:
+    return f'group:{int(group_id)}'
+
+
+def locations(key: str) -> List[str]:
+    """DSNs holding the conversation: the owner first, then the previous owner if it differs"""
+    current, previous = rings()
+    if current is None:
+        return []
+    dsns = [current.shards[current.owner(key)]]
+    if previous is not None:
+        old = previous.shards[previous.owner(key)]
+        if old not in dsns:
+            dsns.append(old)
+    return dsns
+
+
+def all_locations() -> List[str]:
+    current, previous = rings()
+    dsns: List[str] = []
+    for ring in (current, previous):
+        for dsn in (ring.shards.values() if ring else []):
+            if dsn not in dsns:
+                dsns.append(dsn)
+    return dsns
+
+
+def connections(key: Optional[str], main_conn) -> List[Any]:
+    """Connections for a conversation (every shard when key is None); the main one when unsharded"""
+    dsns = locations(key) if key is not None else all_locations()
+    if not dsns:
+        return [main_conn]
+    # Take pooled connections in one global order (by DSN), whatever the owner: during a
+    # rebalance one conversation is A-then-B and another B-then-A, and opposite orders
+    # could leave two full shard pools waiting on each other
+    opened: Dict[str, Any] = {}
+    try:
+        for dsn in sorted(dsns):
+            opened[dsn] = db.connect_dsn(dsn)
+    except Exception:
+        release(opened.values(), main_conn)
+        raise
+    return [opened[dsn] for dsn in dsns]
+
+
+def owner_connection(key: str, main_conn) -> Any:
+    """Connection to the conversation's current owner only, for writes; the main one when unsharded"""
+    dsns = locations(key)
+    return db.connect_dsn(dsns[0]) if dsns else main_conn
+
+
+def release(conns: Iterable[Any], main_conn) -> None:
+    for conn in conns:
+        if conn is not main_conn:
+            conn.close()
+
+
+def merge(messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Combine rows read from several shards: drop copies left by a move, order oldest first"""
+    unique = {message['id']: message for message in messages}
+    return sorted(unique.values(), key=lambda message: (message['created_at'], message['id']))
+
+
+def attach_senders(cur, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Fill sender_name/sender_avatar from users, which stays in the main database"""
+    sender_ids = list({message['sender_id'] for message in messages})
+    if not sender_ids:
+        return messages
+    cur.execute("SELECT id, username, avatar_url FROM users WHERE id = ANY(%s)", (sender_ids,))
+    senders = {row[0]: row for row in cur.fetchall()}
+    for message in messages:
+        sender = senders.get(message['sender_id'])
+        message['sender_name'] = sender[1] if sender else None
+        message['sender_avatar'] = sender[2] if sender else None
+    return messages
@@ -0,0 +1,264 @@
+"""
+Business: Turn user reports into per-user counters and automatic moderation actions
+Args: event with httpMethod, body, headers (X-Moderation-Token; X-User-Id of a moderator for GET and set_status)
+Returns: HTTP response with report aggregates, or how many queued reports a batch processed
+
+report_user (users function) only inserts into user_reports. The work happens here, off the
+request path: process_batch() claims pending reports with FOR UPDATE SKIP LOCKED, so any
+number of workers (server/moderation_worker.py, or POST {"action": "process"} from a timer)
+can drain the queue without taking the same report twice. Each batch folds its reports into
+user_report_counts and escalates users whose distinct reporter count crossed a threshold:
+first rate_limited, then hidden. Actions only escalate, so once a moderator resets a user
+only a stronger action than the last one can apply again.
+
+The app has no sessions, so X-User-Id is only what the caller claims to be. Every request
+here must carry X-Moderation-Token matching the MODERATION_TOKEN secret, which only
+operators and the timer hold; without the secret configured the function refuses
+everything. X-User-Id then just names the moderator acting, and must be one.
+"""
+
+import hmac
+import json
+import os
+from collections import Counter
+from typing import Dict, Any, List, Optional, Tuple
+
+from psycopg2.extras import execute_values
+
+import db
+
+BATCH_SIZE = int(os.environ.get('MODERATION_BATCH_SIZE', '500'))
+RATE_LIMIT_REPORTERS = int(os.environ.get('MODERATION_RATE_LIMIT_REPORTERS', '3'))
+HIDE_REPORTERS = int(os.environ.get('MODERATION_HIDE_REPORTERS', '10'))
+MAX_BATCHES_PER_REQUEST = 20
+
+# Weakest first: escalation only ever moves a user to the right
+STATUSES = ('active', 'rate_limited', 'hidden')
+
+JSON_HEADERS = {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+
+
+def json_response(status: int, payload: Dict[str, Any]) -> Dict[str, Any]:
+    return {'statusCode': status, 'headers': JSON_HEADERS, 'body': json.dumps(payload)}
+
+
+def process_batch(conn, batch_size: int = BATCH_SIZE) -> Tuple[int, List[Tuple[int, str]]]:
+    """Consume up to batch_size pending reports in one transaction.
+
+    Returns how many reports were processed and the (user_id, status) actions taken.
+    """
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            SELECT id, reporter_id, reported_user_id, created_at
+            FROM user_reports
+            WHERE processed_at IS NULL
+            ORDER BY id
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        """, (batch_size,))
+        reports = cur.fetchall()
+        if not reports:
+            return 0, []
+
+        pairs = sorted({(report[2], report[1]) for report in reports})
+        new_reporters = Counter(row[0] for row in execute_values(cur, """
+            INSERT INTO user_report_reporters (reported_user_id, reporter_id) VALUES %s
+            ON CONFLICT DO NOTHING
+            RETURNING reported_user_id
+        """, pairs, fetch=True))
+
+        report_counts = Counter(report[2] for report in reports)
+        last_reported: Dict[int, Any] = {}
+        for report in reports:
+            last_reported[report[2]] = max(last_reported.get(report[2], report[3]), report[3])
+
+        # Fixed user order keeps concurrent workers from deadlocking on the counter rows
+        user_ids = sorted(report_counts)
+        execute_values(cur, """
+            INSERT INTO user_report_counts (user_id, report_count, reporter_count, last_reported_at)
+            VALUES %s
+            ON CONFLICT (user_id) DO UPDATE SET
+                report_count = user_report_counts.report_count + EXCLUDED.report_count,
+                reporter_count = user_report_counts.reporter_count + EXCLUDED.reporter_count,
+                last_reported_at = GREATEST(user_report_counts.last_reported_at, EXCLUDED.last_reported_at),
+                updated_at = CURRENT_TIMESTAMP
+        """, [(user_id, report_counts[user_id], new_reporters[user_id], last_reported[user_id]) for user_id in user_ids])
+
+        cur.execute("""
+            WITH decided AS (
+                SELECT c.user_id,
+                       CASE WHEN c.reporter_count >= %(hide)s THEN 'hidden' ELSE 'rate_limited' END AS action
+                FROM user_report_counts c
+                JOIN users u ON u.id = c.user_id
+                WHERE c.user_id = ANY(%(users)s)
+                  AND c.reporter_count >= %(rate_limit)s
+                  AND u.is_moderator = 0
+            ), escalated AS (
+                UPDATE user_report_counts c
+                SET action = d.action, action_at = CURRENT_TIMESTAMP
+                FROM decided d
+                WHERE c.user_id = d.user_id
+                  AND c.action IS DISTINCT FROM d.action
+                  AND c.action IS DISTINCT FROM 'hidden'
+                RETURNING c.user_id, c.action
+            )
+            UPDATE users u
+            SET moderation_status = e.action
+            FROM escalated e
+            WHERE u.id = e.user_id
+              -- Never weaken a stronger status, e.g. a moderator's manual hide
+              AND array_position(%(statuses)s, e.action) > array_position(%(statuses)s, u.moderation_status::text)
+            RETURNING u.id, u.moderation_status
+        """, {'hide': HIDE_REPORTERS, 'rate_limit': RATE_LIMIT_REPORTERS, 'users': user_ids, 'statuses': list(STATUSES)})
+        actions = cur.fetchall()
+
+        cur.execute(
+            "UPDATE user_reports SET processed_at = CURRENT_TIMESTAMP WHERE id = ANY(%s)",
+            ([report[0] for report in reports],)
+        )
+        conn.commit()
+        return len(reports), actions
+    finally:
+        cur.close()
+
+
+def header(event: Dict[str, Any], name: str) -> Optional[str]:
+    return next((value for key, value in (event.get('headers') or {}).items() if key.lower() == name), None)
+
+
+def has_token(event: Dict[str, Any]) -> bool:
+    expected = os.environ.get('MODERATION_TOKEN')
+    supplied = header(event, 'x-moderation-token')
+    return bool(expected and supplied and hmac.compare_digest(expected.encode('utf-8'), supplied.encode('utf-8')))
+
+
+def is_moderator(cur, event: Dict[str, Any]) -> bool:
+    """Whether the user named by X-User-Id is a moderator; says who acts, not that they may"""
+    user_id = header(event, 'x-user-id')
+    if not user_id or not str(user_id).isdigit():
+        return False
+    cur.execute("SELECT is_moderator FROM users WHERE id = %s", (int(user_id),))
+    row = cur.fetchone()
+    return bool(row and row[0])
+
+
+def int_param(params: Dict[str, Any], name: str, default: int) -> Optional[int]:
+    value = params.get(name)
+    if not value:
+        return default
+    return int(value) if str(value).isdigit() else None
+
+
+@db.read_your_writes
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    method: str = event.get('httpMethod', 'GET')
+
+    if method == 'OPTIONS':
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Moderation-Token, X-Min-Lsn',
+                'Access-Control-Max-Age': '86400'
+            },
+            'body': ''
+        }
+
+    if not has_token(event):
+        return json_response(403, {'error': 'Moderation token required'})
+
+    conn = db.connect_read(event) if method == 'GET' else db.connect_primary()
+    cur = conn.cursor()
+
+    try:
+        if method == 'GET':
+            if not is_moderator(cur, event):
+                return json_response(403, {'error': 'Moderators only'})
+
+            params = event.get('queryStringParameters') or {}
+            status = params.get('status')
+            limit = int_param(params, 'limit', 50)
+            min_reporters = int_param(params, 'min_reporters', 1)
+            if limit is None or min_reporters is None:
+                return json_response(400, {'error': 'limit and min_reporters must be whole numbers'})
+            limit = min(limit, 200)
+
+            cur.execute("""
+                SELECT c.user_id, u.username, u.moderation_status, c.report_count, c.reporter_count,
+                       c.last_reported_at, c.action, c.action_at
+                FROM user_report_counts c
+                JOIN users u ON u.id = c.user_id
+                WHERE c.reporter_count >= %s
+                  AND (%s::text IS NULL OR u.moderation_status = %s)
+                ORDER BY c.reporter_count DESC, c.last_reported_at DESC
+                LIMIT %s
+            """, (min_reporters, status, status, limit))
+            users = [{
+                'user_id': row[0],
+                'username': row[1],
+                'moderation_status': row[2],
+                'report_count': row[3],
+                'reporter_count': row[4],
+                'last_reported_at': row[5].isoformat() if row[5] else None,
+                'action': row[6],
+                'action_at': row[7].isoformat() if row[7] else None
+            } for row in cur.fetchall()]
+
+            cur.execute("SELECT COUNT(*) FROM user_reports WHERE processed_at IS NULL")
+            pending = cur.fetchone()[0]
+
+            return json_response(200, {'users': users, 'pending_reports': pending})
+
+        if method == 'POST':
+            body_data = json.loads(event.get('body') or '{}')
+            action = body_data.get('action')
+
+            if action == 'process':
+                # Drains a bounded number of batches so a timer-triggered call stays short
+                processed, actions = 0, []
+                for _ in range(MAX_BATCHES_PER_REQUEST):
+                    count, batch_actions = process_batch(conn)
+                    processed += count
+                    actions.extend(batch_actions)
+                    if count < BATCH_SIZE:
+                        break
+                return json_response(200, {
+                    'success': True,
+                    'processed': processed,
+                    'actions': [{'user_id': user_id, 'moderation_status': status} for user_id, status in actions]
+                })
+
+            if action == 'set_status':
+                if not is_moderator(cur, event):
+                    return json_response(403, {'error': 'Moderators only'})
+
+                user_id = body_data.get('user_id')
+                status = body_data.get('status')
+                if not user_id or status not in STATUSES:
+                    return json_response(400, {'error': f'user_id and status ({", ".join(STATUSES)}) required'})
+
+                cur.execute(
+                    "UPDATE users SET moderation_status = %s WHERE id = %s RETURNING id",
+                    (status, user_id)
+                )
+                updated = cur.fetchone()
+                if updated and status != 'active':
+                    # Record the manual action so automatic escalation only goes beyond it
+                    cur.execute("""
+                        UPDATE user_report_counts SET action = %s, action_at = CURRENT_TIMESTAMP
+                        WHERE user_id = %s AND action IS DISTINCT FROM 'hidden'
+                    """, (status, user_id))
+                conn.commit()
+                if not updated:
+                    return json_response(404, {'error': 'User not found'})
+                return json_response(200, {'success': True, 'user_id': user_id, 'moderation_status': status})
+
+            return json_response(400, {'error': 'Unknown action'})
+
+        return json_response(405, {'error': 'Method not allowed'})
+
+    finally:
+        cur.close()
+        conn.close()
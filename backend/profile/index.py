@@ -5,10 +5,11 @@ Returns: HTTP response with updated user data
 """
 
 import json
-import os
-import psycopg2
 from typing import Dict, Any
 
+import db
+
+@db.read_your_writes
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     
@@ -18,7 +19,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'POST, GET, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
+                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Min-Lsn',
                 'Access-Control-Max-Age': '86400'
             },
             'body': ''
@@ -35,7 +36,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'body': json.dumps({'error': 'user_id required'})
             }
         
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        conn = db.connect_read(event)
         cur = conn.cursor()
         
         try:
@@ -82,7 +83,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'body': json.dumps({'error': 'user_id required'})
             }
         
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        conn = db.connect_primary()
         cur = conn.cursor()
         
         try:
@@ -5,10 +5,11 @@ Returns: HTTP response with users data
 """
 
 import json
-import os
-import psycopg2
 from typing import Dict, Any
 
+import db
+
+@db.read_your_writes
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     
@@ -19,13 +20,13 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
+                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Min-Lsn',
                 'Access-Control-Max-Age': '86400'
             },
             'body': ''
         }
     
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn = db.connect_read(event) if method == 'GET' else db.connect_primary()
     cur = conn.cursor()
     
     try:
@@ -38,7 +39,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 cur.execute("""
                     SELECT id, username, avatar_url, bio, status, last_seen, is_premium, theme
                     FROM users
-                    WHERE username ILIKE %s
+                    WHERE username ILIKE %s AND moderation_status <> 'hidden'
                     ORDER BY username
                     LIMIT 20
                 """, (f'%{search}%',))
@@ -52,6 +53,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 cur.execute("""
                     SELECT id, username, avatar_url, bio, status, last_seen, is_premium, theme
                     FROM users
+                    WHERE moderation_status <> 'hidden'
                     ORDER BY last_seen DESC
                     LIMIT 50
                 """)
@@ -130,6 +132,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 reported_user_id = body_data.get('reported_user_id')
                 reason = body_data.get('reason', '')
                 
+                # Counted and acted on later by the moderation worker (backend/moderation)
                 cur.execute("""
                     INSERT INTO user_reports (reporter_id, reported_user_id, reason)
                     VALUES (%s, %s, %s)
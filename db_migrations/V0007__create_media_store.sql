@@ -0,0 +1,24 @@
+-- Content-addressed media objects: one row per unique file (SHA-256 of its bytes)
+CREATE TABLE IF NOT EXISTS media_objects (
+  sha256 CHAR(64) PRIMARY KEY,
+  size BIGINT NOT NULL,
+  content_type VARCHAR(255) NOT NULL DEFAULT 'application/octet-stream',
+  storage_key TEXT NOT NULL,
+  duration_ms INTEGER,
+  upload_count INTEGER NOT NULL DEFAULT 1,
+  created_by INTEGER,
+  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Chunked uploads in progress; parts live in storage under uploads/<id>/
+CREATE TABLE IF NOT EXISTS media_uploads (
+  id UUID PRIMARY KEY,
+  user_id INTEGER,
+  file_name TEXT,
+  content_type VARCHAR(255) NOT NULL DEFAULT 'application/octet-stream',
+  kind VARCHAR(10) NOT NULL DEFAULT 'file',
+  bytes_received BIGINT NOT NULL DEFAULT 0,
+  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_media_uploads_created ON media_uploads(created_at);
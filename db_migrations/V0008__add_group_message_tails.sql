@@ -0,0 +1,15 @@
+-- Member count kept on the group so delivery mode is a primary-key lookup
+ALTER TABLE groups ADD COLUMN IF NOT EXISTS member_count INTEGER NOT NULL DEFAULT 0;
+
+UPDATE groups g
+SET member_count = (SELECT COUNT(*) FROM group_members gm WHERE gm.group_id = g.id);
+
+-- Shared tail of recent messages for large groups, served to every member's poll
+CREATE TABLE IF NOT EXISTS group_message_tails (
+  group_id INTEGER PRIMARY KEY,
+  messages JSONB NOT NULL DEFAULT '[]'::jsonb,
+  last_message_id INTEGER,
+  updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_group_messages_group_created ON group_messages(group_id, created_at, id);
@@ -0,0 +1,35 @@
+-- Reports are consumed by the moderation worker; the pending ones are found through a partial index
+ALTER TABLE user_reports ADD COLUMN IF NOT EXISTS processed_at TIMESTAMP;
+
+CREATE INDEX IF NOT EXISTS idx_user_reports_pending ON user_reports(id) WHERE processed_at IS NULL;
+
+-- Each reporter counts once per reported user, however many reports they file
+CREATE TABLE IF NOT EXISTS user_report_reporters (
+  reported_user_id INTEGER NOT NULL,
+  reporter_id INTEGER NOT NULL,
+  first_reported_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (reported_user_id, reporter_id),
+  FOREIGN KEY (reported_user_id) REFERENCES users(id),
+  FOREIGN KEY (reporter_id) REFERENCES users(id)
+);
+
+-- Per-user aggregates that moderators query instead of scanning user_reports
+CREATE TABLE IF NOT EXISTS user_report_counts (
+  user_id INTEGER PRIMARY KEY,
+  report_count INTEGER NOT NULL DEFAULT 0,
+  reporter_count INTEGER NOT NULL DEFAULT 0,
+  last_reported_at TIMESTAMP,
+  action VARCHAR(20),
+  action_at TIMESTAMP,
+  updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+  FOREIGN KEY (user_id) REFERENCES users(id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_user_report_counts_reporters ON user_report_counts(reporter_count DESC, last_reported_at DESC);
+
+-- active, rate_limited or hidden; set by the worker's auto-actions or by a moderator
+ALTER TABLE users ADD COLUMN IF NOT EXISTS moderation_status VARCHAR(20) NOT NULL DEFAULT 'active';
+ALTER TABLE users ADD COLUMN IF NOT EXISTS last_message_at TIMESTAMP;
+ALTER TABLE users ADD COLUMN IF NOT EXISTS is_moderator INTEGER NOT NULL DEFAULT 0;
+
+UPDATE users SET is_moderator = 1 WHERE username = 'Snos';
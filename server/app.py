@@ -0,0 +1,327 @@
+"""
+Business: Self-hosted server running auth, users, profile, messages, groups and moderation in one process
+Args: HTTP requests to /<function>/..., e.g. POST /messages or GET /users?search=bob
+Returns: the function handler's response, unchanged, as an HTTP response
+
+Every function keeps its cloud contract: the request becomes the usual event dict and
+handler(event, context) runs on a worker thread, so the event loop keeps accepting
+connections while handlers wait on Postgres. All handlers share one connection pool per
+DSN (see backend/*/db.py) instead of opening a connection per request.
+
+Design limit: the handlers use blocking psycopg2, so at most SERVER_THREADS of them run
+at once and each holds its thread until it returns. Idle keep-alive connections cost
+nothing, but a handler that waited (a long-poll) would occupy a thread for its whole
+duration. Requests beyond the running ones wait in a queue of SERVER_MAX_QUEUE; past
+that the server answers 503 with Retry-After instead of letting latency grow unbounded.
+A handler that cannot get a pooled connection within DB_POOL_TIMEOUT also gets a 503.
+
+POST /batch runs an ordered list of operations against these functions on one connection
+and in one round trip; see run_batch().
+
+Run: python server/app.py  (SERVER_HOST, SERVER_PORT, SERVER_THREADS, SERVER_POOL_SIZE, SERVER_MAX_QUEUE)
+"""
+
+import asyncio
+import base64
+import json
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from types import ModuleType, SimpleNamespace
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl
+
+from functions import FUNCTIONS, load_function
+
+MAX_BATCH_OPERATIONS = 20
+# Operator-only functions stay on their own endpoint, out of client batches
+UNBATCHED_FUNCTIONS = ('moderation',)
+# Operations that write message shards; with MESSAGE_SHARD_URLS set those commit on
+# their own connection, outside any batch transaction
+SHARDED_WRITES = {('messages', 'send'), ('messages', 'mark_read'),
+                  ('groups', 'send_message'), ('groups', 'add_member')}
+
+JSON_HEADERS = {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+
+
+def busy_response(error: str) -> Dict[str, Any]:
+    return {'statusCode': 503, 'headers': {**JSON_HEADERS, 'Retry-After': '1'}, 'body': json.dumps({'error': error})}
+
+
+def build_event(scope: Dict[str, Any], body: bytes) -> Dict[str, Any]:
+    headers = {key.decode('latin-1'): value.decode('latin-1') for key, value in scope['headers']}
+    query = dict(parse_qsl(scope.get('query_string', b'').decode('latin-1'), keep_blank_values=True))
+
+    try:
+        text, is_base64 = body.decode('utf-8'), False
+    except UnicodeDecodeError:
+        text, is_base64 = base64.b64encode(body).decode('ascii'), True
+
+    return {
+        'httpMethod': scope['method'],
+        'path': scope['path'],
+        'headers': headers,
+        'queryStringParameters': query,
+        'body': text,
+        'isBase64Encoded': is_base64
+    }
+
+
+def encode_response(response: Dict[str, Any]) -> Tuple[int, List[Tuple[bytes, bytes]], bytes]:
+    body = response.get('body') or ''
+    if response.get('isBase64Encoded'):
+        payload = base64.b64decode(body)
+    else:
+        payload = body.encode('utf-8') if isinstance(body, str) else json.dumps(body).encode('utf-8')
+
+    headers = [
+        (str(key).lower().encode('latin-1'), str(value).encode('latin-1'))
+        for key, value in (response.get('headers') or {}).items()
+        if str(key).lower() != 'content-length'
+    ]
+    headers.append((b'content-length', str(len(payload)).encode('latin-1')))
+    return int(response.get('statusCode', 200)), headers, payload
+
+
+class Server:
+    def __init__(self, threads: int, pool_size: int, max_queue: int):
+        self.functions = {name: load_function(name) for name in FUNCTIONS}
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='handler')
+        self.pool_size = pool_size
+        self.pools: Optional[Dict[str, Any]] = None
+        # Only touched from the event loop, so a plain counter is enough
+        self.max_in_flight = threads + max_queue
+        self.in_flight = 0
+        # Each db.py copy defines its own class; a pool of any of them may time out
+        self.pool_timeouts = tuple({module.db.PoolTimeout for module in self.functions.values()})
+
+    def start(self) -> None:
+        if self.pool_size > 0:
+            # The db.py copies are identical, so one set of pools serves every function
+            self.pools = self.functions[FUNCTIONS[0]].db.create_pools(self.pool_size)
+            for module in self.functions.values():
+                module.db.use_pools(self.pools)
+
+    def run_batch(self, payload: Dict[str, Any], headers: Dict[str, str]) -> Dict[str, Any]:
+        """Run operations in order on one primary connection.
+
+        Each operation is {"function", "method", "query", "body"} and gets back
+        {"status", "body"}. With "transaction": true the whole batch commits once at the
+        end and the first failing operation rolls everything back; otherwise every
+        operation commits as it would on its own and failures do not stop the batch.
+        Shard writes cannot be rolled back from here, so a transactional batch containing
+        one is refused with 400 while MESSAGE_SHARD_URLS is set.
+        """
+        operations = payload.get('operations')
+        transactional = bool(payload.get('transaction'))
+
+        if not isinstance(operations, list) or not operations:
+            return {'statusCode': 400, 'headers': JSON_HEADERS, 'body': json.dumps({'error': 'operations required'})}
+        if len(operations) > MAX_BATCH_OPERATIONS:
+            return {'statusCode': 400, 'headers': JSON_HEADERS, 'body': json.dumps({'error': f'At most {MAX_BATCH_OPERATIONS} operations'})}
+        if transactional and self.functions['messages'].shards.all_locations() and any(
+            isinstance(operation, dict) and isinstance(operation.get('body'), dict)
+            and (operation.get('function'), operation['body'].get('action')) in SHARDED_WRITES
+            for operation in operations
+        ):
+            return {'statusCode': 400, 'headers': JSON_HEADERS, 'body': json.dumps({
+                'error': 'Transactional batches cannot include message writes while messages are sharded'
+            })}
+
+        forwarded = {key: value for key, value in headers.items() if key not in ('content-length', 'content-type')}
+        forwarded['content-type'] = 'application/json'
+        db = self.functions[FUNCTIONS[0]].db
+        results: List[Dict[str, Any]] = []
+        lsns: List[str] = []
+        failed = False
+
+        conn = db.connect_primary()
+        try:
+            for operation in operations:
+                if failed and transactional:
+                    results.append({'status': 424, 'body': {'error': 'Skipped after failed operation'}})
+                    continue
+
+                name = operation.get('function') if isinstance(operation, dict) else None
+                module = self.functions.get(name) if name not in UNBATCHED_FUNCTIONS else None
+                if module is None:
+                    results.append({'status': 404, 'body': {'error': 'Unknown function'}})
+                    failed = True
+                    continue
+
+                body = operation.get('body')
+                event = {
+                    'httpMethod': operation.get('method', 'POST' if body is not None else 'GET').upper(),
+                    'path': f'/{name}',
+                    'headers': forwarded,
+                    'queryStringParameters': {key: str(value) for key, value in (operation.get('query') or {}).items()},
+                    'body': json.dumps(body) if body is not None else '',
+                    'isBase64Encoded': False
+                }
+                context = SimpleNamespace(request_id=uuid.uuid4().hex, function_name=name)
+
+                try:
+                    with module.db.bind_connection(conn, transactional):
+                        response = module.handler(event, context)
+                except self.pool_timeouts as e:
+                    response = {'statusCode': 503, 'body': json.dumps({'error': str(e)})}
+                except Exception as e:
+                    response = {'statusCode': 500, 'body': json.dumps({'error': str(e)})}
+
+                status = int(response.get('statusCode', 200))
+                try:
+                    result_body = json.loads(response.get('body') or 'null')
+                except ValueError:
+                    result_body = response.get('body')
+                results.append({'status': status, 'body': result_body})
+
+                lsn = (response.get('headers') or {}).get(db.WAL_LSN_HEADER)
+                if lsn:
+                    lsns.append(lsn)
+                if status >= 400:
+                    failed = True
+                    if not transactional:
+                        # Whatever the failed operation wrote and did not commit must not ride
+                        # along with the next operation's commit
+                        conn.rollback()
+
+            committed = not (transactional and failed)
+            if transactional:
+                if committed:
+                    conn.commit()
+                    if getattr(conn, 'wal_lsn', None):
+                        lsns.append(conn.wal_lsn)
+                else:
+                    conn.rollback()
+        finally:
+            conn.close()
+
+        response_headers = dict(JSON_HEADERS)
+        if lsns:
+            # LSNs compare numerically as hi/lo hex pairs
+            response_headers[db.WAL_LSN_HEADER] = max(lsns, key=lambda lsn: [int(part, 16) for part in lsn.split('/')])
+            response_headers['Access-Control-Expose-Headers'] = db.WAL_LSN_HEADER
+        return {
+            'statusCode': 200,
+            'headers': response_headers,
+            'body': json.dumps({'committed': committed, 'results': results})
+        }
+
+    def stop(self) -> None:
+        self.executor.shutdown(wait=True)
+        if self.pools:
+            for module in self.functions.values():
+                module.db.use_pools(None)
+            for pool in [self.pools['primary'], *self.pools['replicas'], *self.pools['other'].values()]:
+                pool.closeall()
+            self.pools = None
+
+    async def __call__(self, scope: Dict[str, Any], receive, send) -> None:
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+
+        name = scope['path'].strip('/').split('/', 1)[0]
+        module = self.functions.get(name)
+
+        body = b''
+        while True:
+            message = await receive()
+            body += message.get('body', b'')
+            if not message.get('more_body'):
+                break
+
+        if name != 'batch' and module is None:
+            response = {'statusCode': 404, 'headers': JSON_HEADERS, 'body': json.dumps({'error': 'Unknown function'})}
+        elif self.in_flight >= self.max_in_flight:
+            response = busy_response('Server busy')
+        else:
+            self.in_flight += 1
+            try:
+                if name == 'batch':
+                    response = await self.batch(scope, body)
+                else:
+                    response = await self.run_handler(module, name, scope, body)
+            finally:
+                self.in_flight -= 1
+
+        status, headers, payload = encode_response(response)
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': payload})
+
+    async def run_handler(self, module: ModuleType, name: str, scope: Dict[str, Any], body: bytes) -> Dict[str, Any]:
+        event = build_event(scope, body)
+        context = SimpleNamespace(request_id=uuid.uuid4().hex, function_name=name)
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self.executor, module.handler, event, context)
+        except self.pool_timeouts as e:
+            return busy_response(str(e))
+        except Exception as e:
+            return {'statusCode': 500, 'headers': JSON_HEADERS, 'body': json.dumps({'error': str(e)})}
+
+    async def batch(self, scope: Dict[str, Any], body: bytes) -> Dict[str, Any]:
+        if scope['method'] == 'OPTIONS':
+            return {
+                'statusCode': 200,
+                'headers': {
+                    'Access-Control-Allow-Origin': '*',
+                    'Access-Control-Allow-Methods': 'POST, OPTIONS',
+                    'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Min-Lsn',
+                    'Access-Control-Max-Age': '86400'
+                },
+                'body': ''
+            }
+        if scope['method'] != 'POST':
+            return {'statusCode': 405, 'headers': JSON_HEADERS, 'body': json.dumps({'error': 'Method not allowed'})}
+
+        try:
+            payload = json.loads(body or b'{}')
+        except ValueError:
+            return {'statusCode': 400, 'headers': JSON_HEADERS, 'body': json.dumps({'error': 'Invalid JSON'})}
+        if not isinstance(payload, dict):
+            return {'statusCode': 400, 'headers': JSON_HEADERS, 'body': json.dumps({'error': 'Invalid JSON'})}
+
+        headers = {key.decode('latin-1'): value.decode('latin-1') for key, value in scope['headers']}
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self.executor, self.run_batch, payload, headers)
+        except self.pool_timeouts as e:
+            return busy_response(str(e))
+        except Exception as e:
+            return {'statusCode': 500, 'headers': JSON_HEADERS, 'body': json.dumps({'error': str(e)})}
+
+    async def lifespan(self, receive, send) -> None:
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                try:
+                    self.start()
+                except Exception as e:
+                    await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                    return
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.stop()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+app = Server(
+    threads=int(os.environ.get('SERVER_THREADS', '64')),
+    pool_size=int(os.environ.get('SERVER_POOL_SIZE', '20')),
+    max_queue=int(os.environ.get('SERVER_MAX_QUEUE', '1000'))
+)
+
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(
+        app,
+        host=os.environ.get('SERVER_HOST', '0.0.0.0'),
+        port=int(os.environ.get('SERVER_PORT', '8000')),
+        lifespan='on',
+        log_level='warning'
+    )
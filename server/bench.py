@@ -0,0 +1,124 @@
+"""
+Business: HTTP load generator for comparing the one-process server with per-function deployments
+Args: --url, --concurrency, --requests, --method, --body (JSON), --header "Name: value"
+Returns: prints requests/s, error count and latency percentiles
+
+Uses keep-alive connections over plain asyncio streams, so it needs nothing beyond the stdlib.
+"""
+
+import argparse
+import asyncio
+import ssl
+import time
+from typing import List, Tuple
+from urllib.parse import urlsplit
+
+
+def build_request(url: str, method: str, body: str, extra_headers: List[str]) -> Tuple[str, int, bool, bytes]:
+    parts = urlsplit(url)
+    secure = parts.scheme == 'https'
+    port = parts.port or (443 if secure else 80)
+    target = (parts.path or '/') + (f'?{parts.query}' if parts.query else '')
+    payload = body.encode('utf-8')
+
+    lines = [
+        f'{method} {target} HTTP/1.1',
+        f'Host: {parts.hostname}',
+        'Connection: keep-alive',
+        f'Content-Length: {len(payload)}'
+    ]
+    if payload:
+        lines.append('Content-Type: application/json')
+    lines.extend(extra_headers)
+    raw = ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + payload
+    return parts.hostname, port, secure, raw
+
+
+async def read_response(reader: asyncio.StreamReader) -> int:
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError('Connection closed')
+    status = int(status_line.split()[1])
+    length = 0
+    chunked = False
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        if name.lower() == 'content-length':
+            length = int(value.strip())
+        elif name.lower() == 'transfer-encoding' and 'chunked' in value.lower():
+            chunked = True
+    if chunked:
+        while True:
+            size = int((await reader.readline()).strip(), 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    else:
+        await reader.readexactly(length)
+    return status
+
+
+async def worker(host: str, port: int, secure: bool, raw: bytes, counter: List[int],
+                 total: int, latencies: List[float], errors: List[int]) -> None:
+    reader = writer = None
+    while counter[0] < total:
+        counter[0] += 1
+        started = time.perf_counter()
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection(
+                    host, port, ssl=ssl.create_default_context() if secure else None
+                )
+            writer.write(raw)
+            await writer.drain()
+            status = await read_response(reader)
+            if status >= 400:
+                errors[0] += 1
+        except (ConnectionError, asyncio.IncompleteReadError, OSError, ValueError):
+            errors[0] += 1
+            if writer is not None:
+                writer.close()
+            reader = writer = None
+            continue
+        latencies.append(time.perf_counter() - started)
+    if writer is not None:
+        writer.close()
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+async def run(args: argparse.Namespace) -> None:
+    host, port, secure, raw = build_request(args.url, args.method, args.body, args.header)
+    counter, errors, latencies = [0], [0], []
+
+    started = time.perf_counter()
+    await asyncio.gather(*[
+        worker(host, port, secure, raw, counter, args.requests, latencies, errors)
+        for _ in range(args.concurrency)
+    ])
+    elapsed = time.perf_counter() - started
+
+    print(f'{args.method} {args.url}  concurrency={args.concurrency}')
+    print(f'  requests: {len(latencies)} ok, {errors[0]} errors in {elapsed:.2f}s')
+    print(f'  throughput: {len(latencies) / elapsed:.1f} req/s')
+    print(f'  latency ms: p50={percentile(latencies, 50) * 1000:.1f} '
+          f'p95={percentile(latencies, 95) * 1000:.1f} p99={percentile(latencies, 99) * 1000:.1f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--url', required=True)
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--requests', type=int, default=10000)
+    parser.add_argument('--method', default='GET')
+    parser.add_argument('--body', default='')
+    parser.add_argument('--header', action='append', default=[])
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,185 @@
+"""
+Business: Benchmark group delivery (read-time fan-in vs shared tail) at several group sizes
+Args: DATABASE_URL; --members 10,1000,50000 --messages 5000 --seconds 10 --pollers 64 --senders 4 --send-interval 0.2
+Returns: prints poll and send latency, polls/s and how much of a 3 s polling round the DB can serve
+
+Seeds bench_fanout_* users, one group per size and its messages, then for each strategy
+runs the members' polls and a few senders at the same time for --seconds. Every member
+polls once per POLL_INTERVAL; --pollers threads share that schedule, so the offered read
+load grows with the group until the threads saturate. Both strategies read the newest
+TAIL_SIZE messages: fan-in from group_messages, tail from the shared row that every send
+also updates. Everything it created is deleted at the end.
+"""
+
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Tuple
+
+import psycopg2
+
+from functions import load_function
+
+POLL_INTERVAL = 3.0
+PREFIX = 'bench_fanout_'
+
+
+def seed(cur, members: int, messages: int) -> int:
+    cur.execute("""
+        INSERT INTO users (username, password, status)
+        SELECT %s || %s || '_' || i, 'bench', 'offline'
+        FROM generate_series(1, %s) AS i
+    """, (PREFIX, members, members))
+    cur.execute("""
+        INSERT INTO groups (name, description, created_by, member_count)
+        SELECT %s || %s, 'benchmark', MIN(id), %s FROM users WHERE username LIKE %s
+        RETURNING id
+    """, (PREFIX, members, members, f'{PREFIX}{members}\\_%'))
+    group_id = cur.fetchone()[0]
+    cur.execute("""
+        INSERT INTO group_members (group_id, user_id, role)
+        SELECT %s, id, 'member' FROM users WHERE username LIKE %s
+    """, (group_id, f'{PREFIX}{members}\\_%'))
+    cur.execute("""
+        INSERT INTO group_messages (group_id, sender_id, content, created_at)
+        SELECT %s, senders.ids[1 + (i %% array_length(senders.ids, 1))], 'message ' || i,
+               CURRENT_TIMESTAMP - (%s - i) * INTERVAL '1 second'
+        FROM generate_series(1, %s) AS i,
+             (SELECT array_agg(id) AS ids FROM (
+                 SELECT id FROM users WHERE username LIKE %s LIMIT 100
+             ) s) senders
+    """, (group_id, messages, messages, f'{PREFIX}{members}\\_%'))
+    return group_id
+
+
+def cleanup(cur) -> None:
+    cur.execute("SELECT id FROM groups WHERE name LIKE %s", (f'{PREFIX}%',))
+    group_ids = [row[0] for row in cur.fetchall()]
+    if group_ids:
+        cur.execute("DELETE FROM group_message_tails WHERE group_id = ANY(%s)", (group_ids,))
+        cur.execute("DELETE FROM group_messages WHERE group_id = ANY(%s)", (group_ids,))
+        cur.execute("DELETE FROM group_members WHERE group_id = ANY(%s)", (group_ids,))
+        cur.execute("DELETE FROM groups WHERE id = ANY(%s)", (group_ids,))
+    cur.execute("DELETE FROM users WHERE username LIKE %s", (f'{PREFIX}%',))
+
+
+def poll_fan_in(groups, group_id: int) -> None:
+    """What get_messages does without a tail, limited to the TAIL_SIZE newest messages"""
+    conn = groups.db.connect_read({'headers': {}})
+    shard_conns = groups.shards.connections(groups.shards.group_key(group_id), conn)
+    cur = conn.cursor()
+    try:
+        groups.fetch_messages(cur, shard_conns, group_id, groups.TAIL_SIZE)
+    finally:
+        cur.close()
+        groups.shards.release(shard_conns, conn)
+        conn.close()
+
+
+def poll_tail(groups, group_id: int) -> None:
+    call(groups, {'action': 'get_messages', 'group_id': group_id})
+
+
+def call(groups, body: dict) -> None:
+    response = groups.handler({'httpMethod': 'POST', 'headers': {}, 'body': json.dumps(body)}, None)
+    if response['statusCode'] != 200:
+        raise RuntimeError(response['body'])
+
+
+def run_load(groups, poll: Callable, group_id: int, members: int, sender_ids: List[int],
+             args: argparse.Namespace) -> Tuple[List[float], List[float], float]:
+    """Members poll on their schedule while senders post; returns poll and send latencies"""
+    pollers = min(members, args.pollers)
+    period = POLL_INTERVAL * pollers / members
+    deadline = time.perf_counter() + args.seconds
+    polls: List[float] = []
+    sends: List[float] = []
+
+    def poller(index: int) -> None:
+        next_at = time.perf_counter() + period * index / pollers
+        while True:
+            time.sleep(max(0.0, next_at - time.perf_counter()))
+            if time.perf_counter() >= deadline:
+                return
+            started = time.perf_counter()
+            poll(groups, group_id)
+            polls.append(time.perf_counter() - started)
+            next_at = max(next_at + period, started)
+
+    def sender(sender_id: int) -> None:
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            call(groups, {'action': 'send_message', 'group_id': group_id, 'sender_id': sender_id, 'content': 'bench'})
+            sends.append(time.perf_counter() - started)
+            time.sleep(max(0.0, args.send_interval - (time.perf_counter() - started)))
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=pollers + len(sender_ids)) as executor:
+        futures = [executor.submit(poller, index) for index in range(pollers)]
+        futures += [executor.submit(sender, sender_id) for sender_id in sender_ids]
+        for future in futures:
+            future.result()
+    return polls, sends, time.perf_counter() - started
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] * 1000 if ordered else 0.0
+
+
+def report(label: str, members: int, polls: List[float], sends: List[float], elapsed: float) -> None:
+    rate = len(polls) / elapsed
+    needed = members / POLL_INTERVAL
+    print(f'  {label:<8} poll p50={percentile(polls, 0.5):7.2f} ms  p99={percentile(polls, 0.99):7.2f} ms  '
+          f'{rate:8.1f} polls/s  (needs {needed:.0f}/s for every member every {POLL_INTERVAL:.0f}s: '
+          f'{min(1.0, rate / needed) * 100:.0f}% served)  '
+          f'send p50={percentile(sends, 0.5):7.2f} ms  p99={percentile(sends, 0.99):7.2f} ms  '
+          f'{len(sends) / elapsed:6.1f} sends/s')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--members', default='10,1000,50000')
+    parser.add_argument('--messages', type=int, default=5000)
+    parser.add_argument('--seconds', type=float, default=10.0)
+    parser.add_argument('--pollers', type=int, default=64)
+    parser.add_argument('--senders', type=int, default=4)
+    parser.add_argument('--send-interval', type=float, default=0.2)
+    args = parser.parse_args()
+
+    groups = load_function('groups')
+    groups.db.use_pools(groups.db.create_pools(args.pollers + args.senders))
+
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    cur = conn.cursor()
+    try:
+        cleanup(cur)
+        conn.commit()
+
+        for members in [int(value) for value in args.members.split(',')]:
+            group_id = seed(cur, members, args.messages)
+            cur.execute("SELECT user_id FROM group_members WHERE group_id = %s ORDER BY user_id LIMIT %s",
+                        (group_id, args.senders))
+            sender_ids = [row[0] for row in cur.fetchall()]
+            conn.commit()
+            print(f'{members} members, {args.messages} messages, {len(sender_ids)} senders:')
+
+            for label, threshold, poll in (('fan-in', 10 ** 9, poll_fan_in), ('tail', 0, poll_tail)):
+                groups.TAIL_THRESHOLD = threshold
+                if threshold == 0:
+                    groups.rebuild_tail(cur, [conn], group_id)
+                    conn.commit()
+                polls, sends, elapsed = run_load(groups, poll, group_id, members, sender_ids, args)
+                report(label, members, polls, sends, elapsed)
+    finally:
+        conn.rollback()
+        cleanup(cur)
+        conn.commit()
+        cur.close()
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
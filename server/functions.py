@@ -0,0 +1,31 @@
+"""
+Business: Load the backend cloud functions as ordinary modules, for the server and the CLI tools
+Args: a function name from FUNCTIONS, e.g. load_function('groups')
+Returns: the function's index module, with its own db/shards copies bound to it
+
+Importing this module has no side effects: nothing is loaded, pooled or started until
+load_function() is called.
+"""
+
+import importlib
+import os
+import sys
+from types import ModuleType
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend')
+FUNCTIONS = ('auth', 'users', 'profile', 'messages', 'groups', 'moderation')
+FUNCTION_MODULES = ('index', 'db', 'shards')
+
+
+def load_function(name: str) -> ModuleType:
+    """Import backend/<name>/index.py with its own copy of the helper modules next to it"""
+    path = os.path.abspath(os.path.join(BACKEND_DIR, name))
+    for module in FUNCTION_MODULES:
+        sys.modules.pop(module, None)
+    sys.path.insert(0, path)
+    try:
+        return importlib.import_module('index')
+    finally:
+        sys.path.remove(path)
+        for module in FUNCTION_MODULES:
+            sys.modules.pop(module, None)
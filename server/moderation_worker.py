@@ -0,0 +1,71 @@
+"""
+Business: Worker pool draining user_reports into report counters and moderation auto-actions
+Args: DATABASE_URL; --workers 4 --batch 500 --idle 2.0 (seconds to wait when the queue is empty)
+Returns: runs until interrupted, printing each batch that processed reports or acted on users
+
+Every worker claims its own batch with FOR UPDATE SKIP LOCKED (see backend/moderation), so
+workers never wait on each other or process a report twice, and more of them can run on
+other machines against the same database.
+"""
+
+import argparse
+import threading
+import time
+
+from functions import load_function
+
+
+def work(moderation, batch: int, idle: float, stopping: threading.Event) -> None:
+    while not stopping.is_set():
+        try:
+            conn = moderation.db.connect_primary()
+            try:
+                processed, actions = moderation.process_batch(conn, batch)
+            finally:
+                conn.close()
+        except Exception as e:
+            print(f'{threading.current_thread().name}: {e}', flush=True)
+            stopping.wait(idle)
+            continue
+
+        if processed:
+            acted = ', '.join(f'{user_id} -> {status}' for user_id, status in actions)
+            print(f'{threading.current_thread().name}: {processed} reports'
+                  f'{f"; {acted}" if acted else ""}', flush=True)
+        if processed < batch:
+            stopping.wait(idle)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--batch', type=int, default=500)
+    parser.add_argument('--idle', type=float, default=2.0)
+    args = parser.parse_args()
+
+    moderation = load_function('moderation')
+    pools = moderation.db.create_pools(args.workers)
+    moderation.db.use_pools(pools)
+
+    stopping = threading.Event()
+    threads = [
+        threading.Thread(target=work, args=(moderation, args.batch, args.idle, stopping), name=f'worker-{i}')
+        for i in range(args.workers)
+    ]
+    for thread in threads:
+        thread.start()
+    try:
+        while any(thread.is_alive() for thread in threads):
+            time.sleep(0.5)
+    except KeyboardInterrupt:
+        stopping.set()
+        for thread in threads:
+            thread.join()
+    finally:
+        moderation.db.use_pools(None)
+        for pool in [pools['primary'], *pools['replicas'], *pools['other'].values()]:
+            pool.closeall()
+
+
+if __name__ == '__main__':
+    main()
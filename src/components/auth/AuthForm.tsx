@@ -5,6 +5,7 @@ import { Button } from '@/components/ui/button';
 import { Tabs, TabsContent, TabsList, TabsTrigger } from '@/components/ui/tabs';
 import { useToast } from '@/hooks/use-toast';
 import { API_URLS, User } from '@/lib/types';
+import { apiFetch } from '@/lib/api';
 
 interface AuthFormProps {
   onAuthSuccess: (user: User) => void;
@@ -21,7 +22,7 @@ const AuthForm = ({ onAuthSuccess }: AuthFormProps) => {
     try {
       console.log('Attempting auth:', { action: isLogin ? 'login' : 'register', username, url: API_URLS.auth });
       
-      const response = await fetch(API_URLS.auth, {
+      const response = await apiFetch(API_URLS.auth, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({
@@ -13,6 +13,9 @@ interface ChatWindowProps {
   selectedGroup: Group | null;
   messages: Message[];
   groupMessages: GroupMessage[];
+  groupHasMore?: boolean;
+  loadingOlder?: boolean;
+  onLoadOlder?: () => void;
   messageText: string;
   onMessageChange: (text: string) => void;
   onSendMessage: () => void;
@@ -31,6 +34,9 @@ const ChatWindow = ({
   selectedGroup,
   messages,
   groupMessages,
+  groupHasMore,
+  loadingOlder,
+  onLoadOlder,
   messageText,
   onMessageChange,
   onSendMessage,
@@ -189,6 +195,13 @@ const ChatWindow = ({
 
         <ScrollArea className="flex-1 p-4">
           <div className="space-y-4">
+            {groupHasMore && onLoadOlder && (
+              <div className="flex justify-center">
+                <Button variant="ghost" size="sm" onClick={onLoadOlder} disabled={loadingOlder}>
+                  {loadingOlder ? 'Загрузка...' : 'Показать более ранние сообщения'}
+                </Button>
+              </div>
+            )}
             {groupMessages.map((msg) => {
               const isOwn = msg.sender_id === currentUser.id;
               const hasFile = msg.file_url && msg.file_name;
@@ -1,5 +1,6 @@
 import { useState, useEffect } from 'react';
 import { API_URLS, User, Group } from '@/lib/types';
+import { apiFetch } from '@/lib/api';
 import { useToast } from '@/hooks/use-toast';
 
 export function useGroups(currentUser: User | null) {
@@ -18,7 +19,7 @@ export function useGroups(currentUser: User | null) {
   const loadGroups = async () => {
     if (!currentUser) return;
     try {
-      const response = await fetch(API_URLS.groups, {
+      const response = await apiFetch(API_URLS.groups, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({
@@ -43,7 +44,7 @@ export function useGroups(currentUser: User | null) {
   const createGroup = async () => {
     if (!newGroupName.trim() || !currentUser) return;
     try {
-      const response = await fetch(API_URLS.groups, {
+      const response = await apiFetch(API_URLS.groups, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({
@@ -57,7 +58,7 @@ export function useGroups(currentUser: User | null) {
       const groupId = data.group.id;
       
       for (const userId of selectedUsers) {
-        await fetch(API_URLS.groups, {
+        await apiFetch(API_URLS.groups, {
           method: 'POST',
           headers: { 'Content-Type': 'application/json' },
           body: JSON.stringify({
@@ -83,7 +84,7 @@ export function useGroups(currentUser: User | null) {
 
   const loadGroupMembers = async (groupId: number) => {
     try {
-      const response = await fetch(API_URLS.groups, {
+      const response = await apiFetch(API_URLS.groups, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({
@@ -109,7 +110,7 @@ export function useGroups(currentUser: User | null) {
   const updateGroup = async () => {
     if (!selectedGroup || !editGroupName.trim()) return;
     try {
-      await fetch(API_URLS.groups, {
+      await apiFetch(API_URLS.groups, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({
@@ -132,7 +133,7 @@ export function useGroups(currentUser: User | null) {
   const removeMember = async (userId: number) => {
     if (!selectedGroup) return;
     try {
-      await fetch(API_URLS.groups, {
+      await apiFetch(API_URLS.groups, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({
@@ -164,6 +165,7 @@ export function useGroups(currentUser: User | null) {
 
   return {
     groups,
+    setGroups,
     selectedGroup,
     setSelectedGroup,
     showCreateGroup,
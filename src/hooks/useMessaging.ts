@@ -1,25 +1,39 @@
-import { useState, useEffect, useRef, useCallback } from 'react';
-import { API_URLS, User, Message, GroupMessage } from '@/lib/types';
+import { useState, useEffect, useRef, useCallback, useMemo } from 'react';
+import { API_URLS, User, Message, GroupMessage, Group } from '@/lib/types';
+import { apiBatch, apiFetch } from '@/lib/api';
 import { useToast } from '@/hooks/use-toast';
+import { uploadMedia } from '@/lib/media';
 
 export function useMessaging(
   currentUser: User | null,
   selectedChat: User | null,
   selectedGroup: any | null,
-  chatType: 'users' | 'groups'
+  chatType: 'users' | 'groups',
+  onGroupsLoaded?: (groups: Group[]) => void
 ) {
   const { toast } = useToast();
   const [messages, setMessages] = useState<Message[]>([]);
   const [groupMessages, setGroupMessages] = useState<GroupMessage[]>([]);
+  // Pages loaded with before_id; the 3-second poll only refreshes the newest messages
+  const [olderGroupMessages, setOlderGroupMessages] = useState<GroupMessage[]>([]);
+  const [groupHasMore, setGroupHasMore] = useState(false);
+  const [loadingOlder, setLoadingOlder] = useState(false);
+  const pagedBack = useRef(false);
   const [messageText, setMessageText] = useState('');
   const [uploadingFile, setUploadingFile] = useState(false);
   const fileInputRef = useRef<HTMLInputElement>(null);
   const audioRef = useRef<HTMLAudioElement>(null);
-  const lastMessageCount = useRef(0);
+  const lastMessageId = useRef(0);
+  const [chatContact, setChatContact] = useState<User | null>(null);
 
   useEffect(() => {
     if (selectedChat && currentUser && chatType === 'users') {
-      loadMessages();
+      setChatContact(null);
+      if (API_URLS.batch) {
+        openChat();
+      } else {
+        loadMessages();
+      }
       const interval = setInterval(loadMessages, 3000);
       return () => clearInterval(interval);
     }
@@ -28,6 +42,9 @@ export function useMessaging(
 
   useEffect(() => {
     if (selectedGroup && currentUser && chatType === 'groups') {
+      setOlderGroupMessages([]);
+      setGroupHasMore(false);
+      pagedBack.current = false;
       loadGroupMessages();
       const interval = setInterval(loadGroupMessages, 3000);
       return () => clearInterval(interval);
@@ -38,26 +55,55 @@ export function useMessaging(
   const loadMessages = async () => {
     if (!selectedChat || !currentUser) return;
     try {
-      const response = await fetch(
+      const response = await apiFetch(
         `${API_URLS.messages}?user_id=${currentUser.id}&contact_id=${selectedChat.id}`
       );
       const data = await response.json();
-      
-      if (data.messages.length > lastMessageCount.current && lastMessageCount.current > 0) {
-        playNotificationSound();
-      }
-      lastMessageCount.current = data.messages.length;
-      
-      setMessages(data.messages);
+      applyMessages(data.messages);
     } catch (error) {
       console.error('Error loading messages:', error);
     }
   };
 
+  const applyMessages = (loaded: Message[]) => {
+    const lastId = loaded.length ? loaded[loaded.length - 1].id : 0;
+    if (lastId > lastMessageId.current && lastMessageId.current > 0) {
+      playNotificationSound();
+    }
+    lastMessageId.current = lastId;
+    setMessages(loaded);
+  };
+
+  // Server mode: everything opening a chat needs, in one round trip
+  const openChat = async () => {
+    if (!selectedChat || !currentUser) return;
+    try {
+      const [history, , , profile, groups] = await apiBatch(API_URLS.batch, [
+        { function: 'messages', method: 'GET', query: { user_id: currentUser.id, contact_id: selectedChat.id } },
+        { function: 'messages', body: { action: 'mark_read', user_id: currentUser.id, contact_id: selectedChat.id } },
+        { function: 'users', body: { action: 'update_status', user_id: currentUser.id, status: 'online' } },
+        { function: 'profile', method: 'GET', query: { user_id: selectedChat.id } },
+        { function: 'groups', method: 'GET', query: { user_id: currentUser.id } },
+      ]);
+      if (history.status === 200) {
+        applyMessages(history.body.messages);
+      }
+      if (profile.status === 200) {
+        setChatContact(profile.body.user);
+      }
+      if (groups.status === 200 && onGroupsLoaded) {
+        onGroupsLoaded(groups.body.groups || []);
+      }
+    } catch (error) {
+      console.error('Error opening chat:', error);
+      loadMessages();
+    }
+  };
+
   const loadGroupMessages = async () => {
     if (!selectedGroup || !currentUser) return;
     try {
-      const response = await fetch(API_URLS.groups, {
+      const response = await apiFetch(API_URLS.groups, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({
@@ -68,17 +114,52 @@ export function useMessaging(
       });
       const data = await response.json();
       
-      if (data.messages.length > lastMessageCount.current && lastMessageCount.current > 0) {
+      // Large groups return a fixed-size tail, so compare the newest id rather than the count
+      const lastId = data.messages.length ? data.messages[data.messages.length - 1].id : 0;
+      if (lastId > lastMessageId.current && lastMessageId.current > 0) {
         playNotificationSound();
       }
-      lastMessageCount.current = data.messages.length;
+      lastMessageId.current = lastId;
       
       setGroupMessages(data.messages);
+      if (!pagedBack.current) {
+        setGroupHasMore(Boolean(data.has_more));
+      }
     } catch (error) {
       console.error('Error loading group messages:', error);
     }
   };
 
+  const allGroupMessages = useMemo(() => {
+    const recentIds = new Set(groupMessages.map((msg) => msg.id));
+    return [...olderGroupMessages.filter((msg) => !recentIds.has(msg.id)), ...groupMessages];
+  }, [olderGroupMessages, groupMessages]);
+
+  const loadOlderGroupMessages = async () => {
+    if (!selectedGroup || !currentUser || loadingOlder || !allGroupMessages.length) return;
+    setLoadingOlder(true);
+    try {
+      const response = await apiFetch(API_URLS.groups, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({
+          action: 'get_messages',
+          group_id: selectedGroup.id,
+          user_id: currentUser.id,
+          before_id: allGroupMessages[0].id,
+        }),
+      });
+      const data = await response.json();
+      pagedBack.current = true;
+      setOlderGroupMessages((older) => [...data.messages, ...older]);
+      setGroupHasMore(Boolean(data.has_more));
+    } catch (error) {
+      console.error('Error loading older group messages:', error);
+    } finally {
+      setLoadingOlder(false);
+    }
+  };
+
   const playNotificationSound = () => {
     if (audioRef.current) {
       audioRef.current.src = 'https://assets.mixkit.co/active_storage/sfx/2354/2354-preview.mp3';
@@ -86,28 +167,16 @@ export function useMessaging(
     }
   };
 
-  const uploadFile = async (file: File): Promise<string> => {
-    const formData = new FormData();
-    formData.append('file', file);
-    
-    const response = await fetch('https://tmpfiles.org/api/v1/upload', {
-      method: 'POST',
-      body: formData,
-    });
-    const data = await response.json();
-    return data.data.url.replace('tmpfiles.org/', 'tmpfiles.org/dl/');
-  };
-
   const handleFileSelect = async (e: React.ChangeEvent<HTMLInputElement>) => {
     const file = e.target.files?.[0];
     if (!file || !currentUser) return;
     
     setUploadingFile(true);
     try {
-      const fileUrl = await uploadFile(file);
+      const { url: fileUrl } = await uploadMedia(file, currentUser.id);
       
       if (chatType === 'users' && selectedChat) {
-        await fetch(API_URLS.messages, {
+        await apiFetch(API_URLS.messages, {
           method: 'POST',
           headers: { 'Content-Type': 'application/json' },
           body: JSON.stringify({
@@ -121,7 +190,7 @@ export function useMessaging(
         });
         loadMessages();
       } else if (chatType === 'groups' && selectedGroup) {
-        await fetch(API_URLS.groups, {
+        await apiFetch(API_URLS.groups, {
           method: 'POST',
           headers: { 'Content-Type': 'application/json' },
           body: JSON.stringify({
@@ -157,10 +226,10 @@ export function useMessaging(
     if (!currentUser) return;
     try {
       const file = new File([audioBlob], 'voice.webm', { type: 'audio/webm' });
-      const voiceUrl = await uploadFile(file);
+      const { url: voiceUrl, voiceDuration } = await uploadMedia(file, currentUser.id, 'voice');
       
       if (chatType === 'users' && selectedChat) {
-        await fetch(API_URLS.messages, {
+        await apiFetch(API_URLS.messages, {
           method: 'POST',
           headers: { 'Content-Type': 'application/json' },
           body: JSON.stringify({
@@ -169,12 +238,12 @@ export function useMessaging(
             receiver_id: selectedChat.id,
             content: '🎤 Голосовое сообщение',
             voice_url: voiceUrl,
-            voice_duration: duration,
+            voice_duration: voiceDuration ?? duration,
           }),
         });
         loadMessages();
       } else if (chatType === 'groups' && selectedGroup) {
-        await fetch(API_URLS.groups, {
+        await apiFetch(API_URLS.groups, {
           method: 'POST',
           headers: { 'Content-Type': 'application/json' },
           body: JSON.stringify({
@@ -183,7 +252,7 @@ export function useMessaging(
             sender_id: currentUser.id,
             content: '🎤 Голосовое сообщение',
             voice_url: voiceUrl,
-            voice_duration: duration,
+            voice_duration: voiceDuration ?? duration,
           }),
         });
         loadGroupMessages();
@@ -198,7 +267,7 @@ export function useMessaging(
     
     try {
       if (chatType === 'users' && selectedChat) {
-        await fetch(API_URLS.messages, {
+        await apiFetch(API_URLS.messages, {
           method: 'POST',
           headers: { 'Content-Type': 'application/json' },
           body: JSON.stringify({
@@ -211,7 +280,7 @@ export function useMessaging(
         setMessageText('');
         loadMessages();
       } else if (chatType === 'groups' && selectedGroup) {
-        await fetch(API_URLS.groups, {
+        await apiFetch(API_URLS.groups, {
           method: 'POST',
           headers: { 'Content-Type': 'application/json' },
           body: JSON.stringify({
@@ -231,7 +300,11 @@ export function useMessaging(
 
   return {
     messages,
-    groupMessages,
+    groupMessages: allGroupMessages,
+    groupHasMore,
+    loadingOlder,
+    loadOlderGroupMessages,
+    chatContact,
     messageText,
     setMessageText,
     uploadingFile,
@@ -1,6 +1,8 @@
 import { useState } from 'react';
 import { API_URLS, User } from '@/lib/types';
+import { apiFetch } from '@/lib/api';
 import { useToast } from '@/hooks/use-toast';
+import { uploadMedia } from '@/lib/media';
 
 export function useProfile(currentUser: User | null, setCurrentUser: (user: User) => void, users: User[]) {
   const { toast } = useToast();
@@ -18,7 +20,7 @@ export function useProfile(currentUser: User | null, setCurrentUser: (user: User
   const handleUpdateProfile = async (bio: string, avatarUrl: string) => {
     if (!currentUser) return;
     try {
-      await fetch(API_URLS.users, {
+      await apiFetch(API_URLS.users, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({
@@ -39,7 +41,7 @@ export function useProfile(currentUser: User | null, setCurrentUser: (user: User
   const handleReport = async (reportedUserId: number) => {
     if (!currentUser) return;
     try {
-      await fetch(API_URLS.users, {
+      await apiFetch(API_URLS.users, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({
@@ -52,7 +54,7 @@ export function useProfile(currentUser: User | null, setCurrentUser: (user: User
       
       const snosUser = users.find(u => u.username === 'Snos');
       if (snosUser) {
-        await fetch(API_URLS.messages, {
+        await apiFetch(API_URLS.messages, {
           method: 'POST',
           headers: { 'Content-Type': 'application/json' },
           body: JSON.stringify({
@@ -76,26 +78,14 @@ export function useProfile(currentUser: User | null, setCurrentUser: (user: User
     setShowVideoCall(true);
   };
 
-  const uploadFile = async (file: File): Promise<string> => {
-    const formData = new FormData();
-    formData.append('file', file);
-    
-    const response = await fetch('https://tmpfiles.org/api/v1/upload', {
-      method: 'POST',
-      body: formData,
-    });
-    const data = await response.json();
-    return data.data.url.replace('tmpfiles.org/', 'tmpfiles.org/dl/');
-  };
-
   const handleAvatarUpload = async (e: React.ChangeEvent<HTMLInputElement>) => {
     const file = e.target.files?.[0];
     if (!file || !currentUser) return;
     
     try {
-      const avatarUrl = await uploadFile(file);
+      const { url: avatarUrl } = await uploadMedia(file, currentUser.id);
       
-      await fetch(API_URLS.users, {
+      await apiFetch(API_URLS.users, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({
@@ -1,5 +1,6 @@
 import { useState, useEffect } from 'react';
 import { API_URLS, User } from '@/lib/types';
+import { apiFetch } from '@/lib/api';
 
 export function useUsers(currentUser: User | null) {
   const [users, setUsers] = useState<User[]>([]);
@@ -9,7 +10,7 @@ export function useUsers(currentUser: User | null) {
   const loadUsers = async () => {
     if (!currentUser) return;
     try {
-      const response = await fetch(
+      const response = await apiFetch(
         `${API_URLS.users}${searchQuery ? `?search=${searchQuery}` : ''}`
       );
       if (!response.ok) {
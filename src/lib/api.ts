@@ -0,0 +1,53 @@
+const WAL_LSN_HEADER = 'X-Wal-Lsn';
+const MIN_LSN_HEADER = 'X-Min-Lsn';
+
+let lastWriteLsn: string | null = null;
+
+const lsnValue = (lsn: string): bigint => {
+  const [hi, lo] = lsn.split('/');
+  return (BigInt(`0x${hi}`) << 32n) + BigInt(`0x${lo}`);
+};
+
+// Reads carry the WAL position of our last write so the backend only serves them
+// from a replica that has already replayed it.
+export async function apiFetch(input: string, init: RequestInit = {}): Promise<Response> {
+  const headers = new Headers(init.headers);
+  if (lastWriteLsn) {
+    headers.set(MIN_LSN_HEADER, lastWriteLsn);
+  }
+
+  const response = await fetch(input, { ...init, headers });
+
+  const lsn = response.headers.get(WAL_LSN_HEADER);
+  if (lsn && (!lastWriteLsn || lsnValue(lsn) > lsnValue(lastWriteLsn))) {
+    lastWriteLsn = lsn;
+  }
+  return response;
+}
+
+export interface BatchOperation {
+  function: 'auth' | 'users' | 'profile' | 'messages' | 'groups';
+  method?: 'GET' | 'POST';
+  query?: Record<string, string | number>;
+  body?: Record<string, unknown>;
+}
+
+export interface BatchResult {
+  status: number;
+  // eslint-disable-next-line @typescript-eslint/no-explicit-any
+  body: any;
+}
+
+// Runs several function calls in one round trip (server mode only, see API_URLS.batch)
+export async function apiBatch(url: string, operations: BatchOperation[]): Promise<BatchResult[]> {
+  const response = await apiFetch(url, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ operations }),
+  });
+  if (!response.ok) {
+    throw new Error(`Batch failed: ${response.status}`);
+  }
+  const data = await response.json();
+  return data.results;
+}
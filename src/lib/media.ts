@@ -0,0 +1,88 @@
+import { API_URLS } from '@/lib/types';
+
+export interface UploadedMedia {
+  url: string;
+  sha256?: string;
+  voiceDuration?: number | null;
+}
+
+const CHUNK_SIZE = 2 * 1024 * 1024;
+
+const toBase64 = async (blob: Blob): Promise<string> => {
+  const bytes = new Uint8Array(await blob.arrayBuffer());
+  let binary = '';
+  for (let i = 0; i < bytes.length; i += 0x8000) {
+    binary += String.fromCharCode(...bytes.subarray(i, i + 0x8000));
+  }
+  return btoa(binary);
+};
+
+const sha256Hex = async (file: Blob): Promise<string> => {
+  const digest = await crypto.subtle.digest('SHA-256', await file.arrayBuffer());
+  return Array.from(new Uint8Array(digest))
+    .map((b) => b.toString(16).padStart(2, '0'))
+    .join('');
+};
+
+const postMedia = async (body: Record<string, unknown>) => {
+  // Plain fetch: media does not use replicas, and X-Min-Lsn is not in its CORS allow-list
+  const response = await fetch(API_URLS.media, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify(body),
+  });
+  const data = await response.json();
+  if (!response.ok || !data.success) {
+    throw new Error(data.error || 'Upload failed');
+  }
+  return data;
+};
+
+const uploadToTmpfiles = async (file: File): Promise<UploadedMedia> => {
+  const formData = new FormData();
+  formData.append('file', file);
+
+  const response = await fetch('https://tmpfiles.org/api/v1/upload', {
+    method: 'POST',
+    body: formData,
+  });
+  const data = await response.json();
+  return { url: data.data.url.replace('tmpfiles.org/', 'tmpfiles.org/dl/') };
+};
+
+export async function uploadMedia(
+  file: File,
+  userId: number,
+  kind: 'file' | 'voice' = 'file'
+): Promise<UploadedMedia> {
+  if (!API_URLS.media) {
+    return uploadToTmpfiles(file);
+  }
+
+  const sha256 = await sha256Hex(file);
+  const init = await postMedia({
+    action: 'init_upload',
+    user_id: userId,
+    file_name: file.name,
+    content_type: file.type || 'application/octet-stream',
+    kind,
+    sha256,
+  });
+
+  let stored = init;
+  if (!init.exists) {
+    const chunkSize = Math.min(CHUNK_SIZE, init.chunk_size || CHUNK_SIZE);
+    const parts = Math.max(1, Math.ceil(file.size / chunkSize));
+    for (let index = 0; index < parts; index++) {
+      await postMedia({
+        action: 'upload_chunk',
+        upload_id: init.upload_id,
+        index,
+        data: await toBase64(file.slice(index * chunkSize, (index + 1) * chunkSize)),
+      });
+    }
+    stored = await postMedia({ action: 'complete_upload', upload_id: init.upload_id, parts });
+  }
+
+  return { url: stored.url, sha256: stored.sha256, voiceDuration: stored.voice_duration };
+}
@@ -44,9 +44,15 @@ export interface GroupMessage {
   sender_avatar: string | null;
 }
 
+// Self-hosted server mode (server/app.py) serves every function under one origin
+const API_BASE_URL: string | undefined = import.meta.env.VITE_API_BASE_URL;
+
 export const API_URLS = {
-  auth: 'https://functions.poehali.dev/2a65d178-004e-4fc0-bca2-100aa5710b02',
-  users: 'https://functions.poehali.dev/8e70d82c-fbb1-4fb6-ae51-95989346899d',
-  messages: 'https://functions.poehali.dev/69c0a3aa-a913-4b9b-9fda-07225fd45f9b',
-  groups: 'https://functions.poehali.dev/41f03a2b-d2d2-4c00-9dcc-1cf268f31388',
+  auth: API_BASE_URL ? `${API_BASE_URL}/auth` : 'https://functions.poehali.dev/2a65d178-004e-4fc0-bca2-100aa5710b02',
+  users: API_BASE_URL ? `${API_BASE_URL}/users` : 'https://functions.poehali.dev/8e70d82c-fbb1-4fb6-ae51-95989346899d',
+  messages: API_BASE_URL ? `${API_BASE_URL}/messages` : 'https://functions.poehali.dev/69c0a3aa-a913-4b9b-9fda-07225fd45f9b',
+  groups: API_BASE_URL ? `${API_BASE_URL}/groups` : 'https://functions.poehali.dev/41f03a2b-d2d2-4c00-9dcc-1cf268f31388',
+  media: import.meta.env.VITE_MEDIA_URL ?? '',
+  // POST /batch exists only in server mode
+  batch: API_BASE_URL ? `${API_BASE_URL}/batch` : '',
 };
\ No newline at end of file
@@ -37,6 +37,7 @@ const Index = ({ theme, setTheme }: IndexProps) => {
 
   const {
     groups,
+    setGroups,
     selectedGroup,
     setSelectedGroup,
     showCreateGroup,
@@ -64,6 +65,10 @@ const Index = ({ theme, setTheme }: IndexProps) => {
   const {
     messages,
     groupMessages,
+    groupHasMore,
+    loadingOlder,
+    loadOlderGroupMessages,
+    chatContact,
     messageText,
     setMessageText,
     uploadingFile,
@@ -72,7 +77,7 @@ const Index = ({ theme, setTheme }: IndexProps) => {
     sendMessage,
     handleFileSelect,
     handleVoiceSend
-  } = useMessaging(currentUser, selectedChat, selectedGroup, chatType);
+  } = useMessaging(currentUser, selectedChat, selectedGroup, chatType, setGroups);
 
   const {
     showProfile,
@@ -147,10 +152,13 @@ const Index = ({ theme, setTheme }: IndexProps) => {
         <ChatWindow
           currentUser={currentUser}
           chatType={chatType}
-          selectedChat={selectedChat}
+          selectedChat={chatContact?.id === selectedChat?.id ? chatContact : selectedChat}
           selectedGroup={selectedGroup}
           messages={messages}
           groupMessages={groupMessages}
+          groupHasMore={groupHasMore}
+          loadingOlder={loadingOlder}
+          onLoadOlder={loadOlderGroupMessages}
           messageText={messageText}
           onMessageChange={setMessageText}
           onSendMessage={sendMessage}
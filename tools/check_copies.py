@@ -0,0 +1,74 @@
+"""
+Business: Fail when the helper modules copied into several cloud functions have drifted apart
+Args: --sync FUNCTION copies that function's version over every other copy instead of checking
+Returns: exit status 1 and the differing files when copies do not match; run by npm run lint
+
+Each function in backend/ is deployed on its own, so shared helpers (db.py, shards.py) live
+as a copy in every function directory that imports them. Edit one copy, then run
+    python3 tools/check_copies.py --sync messages
+to spread the edit, and commit all copies together.
+"""
+
+import argparse
+import glob
+import hashlib
+import os
+import shutil
+import sys
+from collections import defaultdict
+from typing import Dict, List
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend')
+SHARED_MODULES = ('db.py', 'shards.py')
+
+
+def copies(module: str) -> List[str]:
+    return sorted(glob.glob(os.path.join(BACKEND_DIR, '*', module)))
+
+
+def digest(path: str) -> str:
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def function_name(path: str) -> str:
+    return os.path.basename(os.path.dirname(path))
+
+
+def check() -> int:
+    drifted = 0
+    for module in SHARED_MODULES:
+        by_digest: Dict[str, List[str]] = defaultdict(list)
+        for path in copies(module):
+            by_digest[digest(path)].append(function_name(path))
+        if len(by_digest) > 1:
+            drifted += 1
+            print(f'{module} differs between functions:', file=sys.stderr)
+            for digest_value, functions in sorted(by_digest.items(), key=lambda item: -len(item[1])):
+                print(f'  {digest_value[:12]}  {", ".join(functions)}', file=sys.stderr)
+    if drifted:
+        print('Make the edit in one copy and run: python3 tools/check_copies.py --sync <function>', file=sys.stderr)
+    return 1 if drifted else 0
+
+
+def sync(source_function: str) -> int:
+    for module in SHARED_MODULES:
+        source = os.path.join(BACKEND_DIR, source_function, module)
+        if not os.path.exists(source):
+            continue
+        for path in copies(module):
+            if path != source and digest(path) != digest(source):
+                shutil.copyfile(source, path)
+                print(f'updated {function_name(path)}/{module}')
+    return check()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sync', metavar='FUNCTION')
+    args = parser.parse_args()
+    sys.exit(sync(args.sync) if args.sync else check())
+
+
+if __name__ == '__main__':
+    main()
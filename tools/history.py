@@ -0,0 +1,367 @@
+"""
+Business: Stream a user's direct messages or a group's messages to compressed NDJSON and load them back
+Args: export --user ID | --group ID -o FILE(.gz|.zst); import FILE [--chunk 50000] [--rebuild-indexes]
+Returns: the export file, or rows loaded into DATABASE_URL (or the owning shards); prints rows/s
+
+Rows never pass through Python objects on export: Postgres renders each one with row_to_json
+and COPY streams it straight into the compressor, so memory stays flat however long the
+history is. The CSV options below use control characters that JSON always escapes, which
+makes COPY emit and accept the JSON text unchanged. Import decompresses into COPY in chunks,
+moves each chunk from a staging table into the real one (existing ids are skipped, so a
+rerun is safe), and with --rebuild-indexes drops the secondary indexes for the load and
+recreates them at the end. Use that only on a database nobody is reading, such as a fresh
+restore. An id that is already taken by a different message (same id, other sender, time or
+text) stops the import: only a rerun of the same file into the same history is skipped.
+
+The first line of a file is a header naming the table it holds. Exports from shards carry
+64-bit ids (shard number above bit 40); importing them into the main database's 32-bit
+SERIAL tables is refused rather than renumbering messages. After a group import the
+group's cached tail (see backend/groups) is rebuilt from the loaded rows.
+"""
+
+import argparse
+import datetime
+import gzip
+import io
+import json
+import os
+import sys
+import time
+from typing import BinaryIO, Dict, List, Optional
+
+import psycopg2
+from psycopg2 import sql
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend', 'messages'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server'))
+
+from rebalance_shards import DM_COLUMNS, GROUP_COLUMNS  # noqa: E402
+from shards import all_locations, connections, dm_key, group_key, locations, release  # noqa: E402
+from functions import load_function  # noqa: E402
+
+FORMAT = 'anonimmes-history'
+TABLES = {'messages': DM_COLUMNS, 'group_messages': GROUP_COLUMNS}
+COPY_OPTIONS = "(FORMAT csv, QUOTE E'\\x01', DELIMITER E'\\x02')"
+LOCAL_ID_MASK = (1 << 40) - 1
+ID_LIMITS = {'integer': (1 << 31) - 1, 'bigint': (1 << 63) - 1}
+# Columns that never change after a send (is_read does): a row already present with the same
+# id must match on these, or it is a different message that happens to share the id
+IDENTITY_COLUMNS = {
+    'messages': ('sender_id', 'receiver_id', 'created_at', 'content'),
+    'group_messages': ('group_id', 'sender_id', 'created_at', 'content')
+}
+
+
+class CountingWriter:
+    """File wrapper counting the NDJSON lines COPY writes through it"""
+
+    def __init__(self, fh: BinaryIO):
+        self.fh = fh
+        self.rows = 0
+
+    def write(self, data: bytes) -> int:
+        self.rows += data.count(b'\n')
+        return self.fh.write(data)
+
+
+def compression_for(path: str, requested: Optional[str]) -> str:
+    if requested:
+        return requested
+    if path.endswith('.zst'):
+        return 'zstd'
+    if path.endswith('.gz'):
+        return 'gzip'
+    return 'none'
+
+
+def zstandard_module():
+    try:
+        import zstandard
+    except ImportError:
+        sys.exit('zstd files need the zstandard package: pip install zstandard')
+    return zstandard
+
+
+def open_output(path: str, compression: str, level: Optional[int]) -> BinaryIO:
+    if compression == 'gzip':
+        return gzip.open(path, 'wb', compresslevel=level or 6)
+    if compression == 'zstd':
+        zstandard = zstandard_module()
+        return zstandard.ZstdCompressor(level=level or 3).stream_writer(open(path, 'wb'))
+    return open(path, 'wb')
+
+
+def open_input(path: str, compression: str) -> BinaryIO:
+    if compression == 'gzip':
+        return gzip.open(path, 'rb')
+    if compression == 'zstd':
+        zstandard = zstandard_module()
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(open(path, 'rb')))
+    return open(path, 'rb')
+
+
+def report(action: str, rows: int, path: str, started: float) -> None:
+    elapsed = max(time.perf_counter() - started, 1e-9)
+    size = os.path.getsize(path) / 1024 / 1024
+    print(f'{action} {rows} rows in {elapsed:.1f}s: {rows / elapsed:.0f} rows/s, '
+          f'{size:.1f} MB compressed ({size / elapsed:.1f} MB/s)', file=sys.stderr)
+
+
+def export_history(args: argparse.Namespace) -> None:
+    if args.user is not None:
+        table, key, where, params = 'messages', None, "sender_id = %s OR receiver_id = %s", (args.user, args.user)
+    else:
+        table, key, where, params = 'group_messages', group_key(args.group), "group_id = %s", (args.group,)
+
+    header = {
+        'format': FORMAT,
+        'version': 1,
+        'table': table,
+        'user_id': args.user,
+        'group_id': args.group,
+        'exported_at': datetime.datetime.now(datetime.timezone.utc).isoformat()
+    }
+    columns = sql.SQL(', ').join(map(sql.Identifier, TABLES[table]))
+    query = sql.SQL("COPY (SELECT row_to_json(t) FROM (SELECT {} FROM {} WHERE {}) t) TO STDOUT {}").format(
+        columns, sql.Identifier(table), sql.SQL(where), sql.SQL(COPY_OPTIONS)
+    )
+
+    started = time.perf_counter()
+    main_conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    # A user's conversations are spread over every shard; a group lives on its owner
+    shard_conns = connections(key, main_conn)
+    try:
+        with open_output(args.output, compression_for(args.output, args.compression), args.level) as fh:
+            fh.write((json.dumps(header) + '\n').encode('utf-8'))
+            writer = CountingWriter(fh)
+            for conn in shard_conns:
+                with conn.cursor() as cur:
+                    cur.copy_expert(cur.mogrify(query, params).decode('utf-8'), writer)
+                conn.rollback()
+    finally:
+        release(shard_conns, main_conn)
+        main_conn.close()
+
+    report('exported', writer.rows, args.output, started)
+
+
+def secondary_indexes(cur, table: str) -> List[tuple]:
+    """Indexes on the table other than those backing the primary key or other constraints"""
+    cur.execute("""
+        SELECT i.relname, pg_get_indexdef(i.oid)
+        FROM pg_index x
+        JOIN pg_class i ON i.oid = x.indexrelid
+        WHERE x.indrelid = %s::regclass
+          AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conindid = x.indexrelid)
+    """, (table,))
+    return cur.fetchall()
+
+
+def id_limit(cur, table: str) -> int:
+    """Largest id the table's id column holds: SERIAL tables are integer, shard tables bigint"""
+    cur.execute("SELECT format_type(atttypid, NULL) FROM pg_attribute WHERE attrelid = %s::regclass AND attname = 'id'",
+                (table,))
+    return ID_LIMITS.get(cur.fetchone()[0], ID_LIMITS['bigint'])
+
+
+def advance_ids(cur, table: str) -> None:
+    """Move the id sequence past imported ids so new messages do not collide with them"""
+    cur.execute("SELECT pg_get_serial_sequence(%s, 'id')", (table,))
+    sequence = cur.fetchone()[0]
+    if sequence:
+        cur.execute(sql.SQL("SELECT setval(%s, GREATEST(nextval(%s), (SELECT MAX(id) FROM {})))").format(
+            sql.Identifier(table)
+        ), (sequence, sequence))
+        return
+    cur.execute("SELECT to_regclass('message_local_id_seq') IS NOT NULL")
+    if cur.fetchone()[0]:
+        # Shard ids carry the shard number above bit 40; only this shard's own ids matter
+        cur.execute(sql.SQL("""
+            SELECT setval('message_local_id_seq', GREATEST(nextval('message_local_id_seq'),
+                (SELECT MAX(id & %s) FROM {} WHERE id >> 40 = (SELECT next_message_id() >> 40))))
+        """).format(sql.Identifier(table)), (LOCAL_ID_MASK,))
+
+
+class Destination:
+    """One database receiving rows: a staging table plus the chunk waiting to be copied into it"""
+
+    def __init__(self, conn, table: str, rebuild_indexes: bool):
+        self.conn = conn
+        self.table = table
+        self.buffer = io.BytesIO()
+        self.pending = 0
+        self.rows = 0
+        self.indexes: List[tuple] = []
+
+        cur = conn.cursor()
+        self.max_id = id_limit(cur, table)
+        cur.execute("CREATE TEMP TABLE history_import (doc jsonb)")
+        if rebuild_indexes:
+            self.indexes = secondary_indexes(cur, table)
+            for name, _ in self.indexes:
+                cur.execute(sql.SQL("DROP INDEX {}").format(sql.Identifier(name)))
+        conn.commit()
+        cur.close()
+
+    def add(self, line: bytes) -> None:
+        self.buffer.write(line if line.endswith(b'\n') else line + b'\n')
+        self.pending += 1
+
+    def flush(self) -> None:
+        if not self.pending:
+            return
+        columns = sql.SQL(', ').join(map(sql.Identifier, TABLES[self.table]))
+        self.buffer.seek(0)
+        with self.conn.cursor() as cur:
+            cur.copy_expert(f"COPY history_import (doc) FROM STDIN {COPY_OPTIONS}", self.buffer)
+            cur.execute("SELECT MAX((doc->>'id')::numeric) FROM history_import")
+            largest = cur.fetchone()[0]
+            if largest is not None and largest > self.max_id:
+                self.conn.rollback()
+                sys.exit(f'{self.table}.id here only holds ids up to {self.max_id}, but the file has id {largest}: '
+                         'it was exported from message shards. Import it with MESSAGE_SHARD_URLS set, or '
+                         f'migrate {self.table}.id to bigint first. Rows loaded so far stay; a rerun skips them.')
+            cur.execute(sql.SQL("""
+                INSERT INTO {table} ({columns})
+                SELECT {columns} FROM history_import, jsonb_populate_record(NULL::{table}, doc)
+                ON CONFLICT (id) DO NOTHING
+            """).format(table=sql.Identifier(self.table), columns=columns))
+            inserted = cur.rowcount
+            if inserted < self.pending:
+                # Some ids were already there: they must be the same messages. Each skipped row is
+                # looked up by primary key (OFFSET 0 keeps the planner from merge-joining the table)
+                cur.execute(sql.SQL("""
+                    SELECT COUNT(*), MIN(r.id)
+                    FROM history_import, jsonb_populate_record(NULL::{table}, doc) r,
+                         LATERAL (SELECT * FROM {table} t WHERE t.id = r.id OFFSET 0) t
+                    WHERE ({imported}) IS DISTINCT FROM ({existing})
+                """).format(
+                    table=sql.Identifier(self.table),
+                    imported=sql.SQL(', ').join(sql.Identifier('r', column) for column in IDENTITY_COLUMNS[self.table]),
+                    existing=sql.SQL(', ').join(sql.Identifier('t', column) for column in IDENTITY_COLUMNS[self.table])
+                ))
+                conflicts, first_conflict = cur.fetchone()
+                if conflicts:
+                    self.conn.rollback()
+                    sys.exit(f'{conflicts} rows in this chunk have ids already used by different messages in '
+                             f'{self.table} (first: id {first_conflict}), so this is not the database the file came '
+                             'from. Import it into an empty table or the source database. Rows loaded so far stay.')
+            self.rows += inserted
+            cur.execute("TRUNCATE history_import")
+        self.conn.commit()
+        self.buffer = io.BytesIO()
+        self.pending = 0
+
+    def restore_indexes(self) -> None:
+        with self.conn.cursor() as cur:
+            for _, definition in self.indexes:
+                cur.execute(definition)
+        self.conn.commit()
+        self.indexes = []
+
+    def finish(self) -> None:
+        self.flush()
+        self.restore_indexes()
+        with self.conn.cursor() as cur:
+            advance_ids(cur, self.table)
+        self.conn.commit()
+        self.conn.autocommit = True
+        with self.conn.cursor() as cur:
+            cur.execute(sql.SQL("ANALYZE {}").format(sql.Identifier(self.table)))
+
+
+def rebuild_group_tail(main_conn, group_id: int) -> None:
+    """Regenerate a large group's tail so its members see the imported messages"""
+    groups = load_function('groups')
+    shard_conns = connections(group_key(group_id), main_conn)
+    try:
+        with main_conn.cursor() as cur:
+            if groups.is_large_group(cur, group_id):
+                groups.rebuild_tail(cur, shard_conns, group_id)
+                shard_conns[0].commit()
+    finally:
+        release(shard_conns, main_conn)
+
+
+def import_history(args: argparse.Namespace) -> None:
+    started = time.perf_counter()
+    main_conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    destinations: Dict[str, Destination] = {}
+    rows = 0
+
+    try:
+        with open_input(args.input, compression_for(args.input, args.compression)) as fh:
+            header = json.loads(fh.readline() or b'{}')
+            table = header.get('table')
+            if header.get('format') != FORMAT or table not in TABLES:
+                sys.exit(f'{args.input} is not a history export')
+
+            def destination(key: Optional[str]) -> Destination:
+                dsn = (locations(key) or [None])[0] if key else None
+                if dsn not in destinations:
+                    conn = main_conn if dsn is None else psycopg2.connect(dsn)
+                    destinations[dsn] = Destination(conn, table, args.rebuild_indexes)
+                return destinations[dsn]
+
+            sharded = bool(all_locations())
+            for line in fh:
+                if not line.strip():
+                    continue
+                key: Optional[str] = None
+                if sharded:
+                    # Each row goes to the shard that owns its conversation today
+                    row = json.loads(line)
+                    key = group_key(row['group_id']) if table == 'group_messages' else dm_key(row['sender_id'], row['receiver_id'])
+                target = destination(key)
+                target.add(line)
+                rows += 1
+                if target.pending >= args.chunk:
+                    target.flush()
+
+        for target in destinations.values():
+            target.finish()
+        if table == 'group_messages' and header.get('group_id') is not None:
+            rebuild_group_tail(main_conn, header['group_id'])
+    finally:
+        for target in destinations.values():
+            if target.indexes and not target.conn.closed:
+                # The load failed part-way: put the dropped indexes back before leaving
+                target.conn.rollback()
+                target.restore_indexes()
+        for target in destinations.values():
+            if not target.conn.closed and target.conn is not main_conn:
+                target.conn.close()
+        main_conn.close()
+
+    loaded = sum(target.rows for target in destinations.values())
+    report('imported', rows, args.input, started)
+    print(f'{loaded} new, {rows - loaded} already present', file=sys.stderr)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = commands.add_parser('export')
+    owner = export_parser.add_mutually_exclusive_group(required=True)
+    owner.add_argument('--user', type=int)
+    owner.add_argument('--group', type=int)
+    export_parser.add_argument('-o', '--output', required=True)
+    export_parser.add_argument('--compression', choices=('gzip', 'zstd', 'none'))
+    export_parser.add_argument('--level', type=int)
+
+    import_parser = commands.add_parser('import')
+    import_parser.add_argument('input')
+    import_parser.add_argument('--compression', choices=('gzip', 'zstd', 'none'))
+    import_parser.add_argument('--chunk', type=int, default=50000)
+    import_parser.add_argument('--rebuild-indexes', action='store_true')
+
+    args = parser.parse_args()
+    if args.command == 'export':
+        export_history(args)
+    else:
+        import_history(args)
+
+
+if __name__ == '__main__':
+    main()
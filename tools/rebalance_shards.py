@@ -0,0 +1,141 @@
+"""
+Business: Move conversations to the shard that owns them after the shard ring changes
+Args: MESSAGE_SHARD_URLS (new ring), MESSAGE_SHARD_URLS_PREVIOUS (old ring); --batch 5000 --dry-run
+Returns: prints how many conversations and messages moved from each source
+
+Runs online: while MESSAGE_SHARD_URLS_PREVIOUS is set the handlers write to the new owner and
+read both owners, so each conversation is copied in id order (ON CONFLICT skips rows already
+there), committed on the new owner, and only then deleted from the old one. The old ring may
+list the main database as shard 0 when moving off an unsharded setup:
+    MESSAGE_SHARD_URLS_PREVIOUS="0=$DATABASE_URL"
+Unset MESSAGE_SHARD_URLS_PREVIOUS once this finishes.
+"""
+
+import argparse
+import os
+import sys
+from typing import Dict, List, Tuple
+
+import psycopg2
+from psycopg2.extras import Json, execute_values
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend', 'messages'))
+
+from shards import Ring, dm_key, group_key, parse_shards  # noqa: E402
+
+DM_COLUMNS = ('id', 'sender_id', 'receiver_id', 'content', 'file_url', 'file_name', 'is_read',
+              'created_at', 'voice_url', 'voice_duration')
+GROUP_COLUMNS = ('id', 'group_id', 'sender_id', 'content', 'file_url', 'file_name', 'created_at',
+                 'message_type', 'duration', 'voice_url', 'voice_duration')
+
+
+def copy_rows(source, target, table: str, columns: Tuple[str, ...], where: str, params: tuple,
+              batch: int) -> int:
+    """Copy matching rows in id order, committing on the target after each batch"""
+    copied = 0
+    last_id = -1
+    column_list = ', '.join(columns)
+    with source.cursor() as src, target.cursor() as dst:
+        while True:
+            src.execute(
+                f"SELECT {column_list} FROM {table} WHERE {where} AND id > %s ORDER BY id LIMIT %s",
+                params + (last_id, batch)
+            )
+            rows = src.fetchall()
+            source.rollback()
+            if not rows:
+                return copied
+            execute_values(
+                dst,
+                f"INSERT INTO {table} ({column_list}) VALUES %s ON CONFLICT (id) DO NOTHING",
+                rows
+            )
+            target.commit()
+            copied += len(rows)
+            last_id = rows[-1][0]
+
+
+def move_dm(source, target, low: int, high: int, batch: int) -> int:
+    where = "LEAST(sender_id, receiver_id) = %s AND GREATEST(sender_id, receiver_id) = %s"
+    copied = copy_rows(source, target, 'messages', DM_COLUMNS, where, (low, high), batch)
+    with source.cursor() as cur:
+        cur.execute(f"DELETE FROM messages WHERE {where}", (low, high))
+    source.commit()
+    return copied
+
+
+def move_group(source, target, group_id: int, batch: int) -> int:
+    copied = copy_rows(source, target, 'group_messages', GROUP_COLUMNS, "group_id = %s", (group_id,), batch)
+    with source.cursor() as src, target.cursor() as dst:
+        src.execute("SELECT messages, last_message_id, updated_at FROM group_message_tails WHERE group_id = %s", (group_id,))
+        tail = src.fetchone()
+        if tail:
+            # A send during the move may already have built a newer tail on the target
+            dst.execute("""
+                INSERT INTO group_message_tails (group_id, messages, last_message_id, updated_at)
+                VALUES (%s, %s::jsonb, %s, %s) ON CONFLICT (group_id) DO NOTHING
+            """, (group_id, Json(tail[0]), tail[1], tail[2]))
+            target.commit()
+        src.execute("DELETE FROM group_message_tails WHERE group_id = %s", (group_id,))
+        src.execute("DELETE FROM group_messages WHERE group_id = %s", (group_id,))
+    source.commit()
+    return copied
+
+
+def rebalance_source(number: int, dsn: str, current: Ring, targets: Dict[str, object],
+                     batch: int, dry_run: bool) -> None:
+    source = psycopg2.connect(dsn)
+    try:
+        with source.cursor() as cur:
+            cur.execute("""
+                SELECT DISTINCT LEAST(sender_id, receiver_id), GREATEST(sender_id, receiver_id) FROM messages
+            """)
+            pairs: List[Tuple[int, int]] = cur.fetchall()
+            cur.execute("SELECT DISTINCT group_id FROM group_messages")
+            group_ids = [row[0] for row in cur.fetchall()]
+        source.rollback()
+
+        moves = [('dm', pair, current.shards[current.owner(dm_key(*pair))]) for pair in pairs]
+        moves += [('group', group_id, current.shards[current.owner(group_key(group_id))]) for group_id in group_ids]
+        moves = [move for move in moves if move[2] != dsn]
+        print(f'shard {number}: {len(moves)} of {len(pairs) + len(group_ids)} conversations to move')
+        if dry_run:
+            return
+
+        moved_messages = 0
+        for kind, key, target_dsn in moves:
+            if target_dsn not in targets:
+                targets[target_dsn] = psycopg2.connect(target_dsn)
+            target = targets[target_dsn]
+            if kind == 'dm':
+                moved_messages += move_dm(source, target, key[0], key[1], batch)
+            else:
+                moved_messages += move_group(source, target, key, batch)
+        print(f'shard {number}: moved {len(moves)} conversations, {moved_messages} messages')
+    finally:
+        source.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--batch', type=int, default=5000)
+    parser.add_argument('--dry-run', action='store_true')
+    args = parser.parse_args()
+
+    current_shards = parse_shards(os.environ.get('MESSAGE_SHARD_URLS', ''))
+    previous_shards = parse_shards(os.environ.get('MESSAGE_SHARD_URLS_PREVIOUS', ''))
+    if not current_shards or not previous_shards:
+        parser.error('Set MESSAGE_SHARD_URLS to the new ring and MESSAGE_SHARD_URLS_PREVIOUS to the old one')
+
+    current = Ring(current_shards)
+    targets: Dict[str, object] = {}
+    try:
+        for number, dsn in sorted(previous_shards.items()):
+            rebalance_source(number, dsn, current, targets, args.batch, args.dry_run)
+    finally:
+        for conn in targets.values():
+            conn.close()
+
+
+if __name__ == '__main__':
+    main()
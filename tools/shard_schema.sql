@@ -0,0 +1,50 @@
+-- Message storage for one shard (see backend/messages/shards.py).
+-- Apply with: psql "$SHARD_DSN" -v ON_ERROR_STOP=1 -v shard_no=N -f tools/shard_schema.sql
+-- shard_no must match the number given in MESSAGE_SHARD_URLS and be 1..4095: ids are
+-- (shard_no << 40) | local sequence, so rows keep unique ids when they move between shards.
+
+CREATE SEQUENCE IF NOT EXISTS message_local_id_seq;
+
+SELECT format(
+  'CREATE OR REPLACE FUNCTION next_message_id() RETURNS BIGINT LANGUAGE sql AS %L',
+  format('SELECT (%s::bigint << 40) | nextval(''message_local_id_seq'')', :'shard_no'::integer)
+) \gexec
+
+CREATE TABLE IF NOT EXISTS messages (
+  id BIGINT PRIMARY KEY DEFAULT next_message_id(),
+  sender_id INTEGER NOT NULL,
+  receiver_id INTEGER NOT NULL,
+  content TEXT NOT NULL,
+  file_url TEXT,
+  file_name TEXT,
+  is_read BOOLEAN DEFAULT FALSE,
+  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+  voice_url TEXT,
+  voice_duration INTEGER
+);
+
+CREATE TABLE IF NOT EXISTS group_messages (
+  id BIGINT PRIMARY KEY DEFAULT next_message_id(),
+  group_id INTEGER NOT NULL,
+  sender_id INTEGER NOT NULL,
+  content TEXT NOT NULL,
+  file_url TEXT,
+  file_name TEXT,
+  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+  message_type VARCHAR(20) DEFAULT 'text',
+  duration INTEGER,
+  voice_url TEXT,
+  voice_duration INTEGER
+);
+
+CREATE TABLE IF NOT EXISTS group_message_tails (
+  group_id INTEGER PRIMARY KEY,
+  messages JSONB NOT NULL DEFAULT '[]'::jsonb,
+  last_message_id BIGINT,
+  updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_messages_pair ON messages(sender_id, receiver_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_messages_conversation
+  ON messages(LEAST(sender_id, receiver_id), GREATEST(sender_id, receiver_id), id);
+CREATE INDEX IF NOT EXISTS idx_group_messages_group_created ON group_messages(group_id, created_at, id);
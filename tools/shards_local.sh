@@ -0,0 +1,36 @@
+#!/bin/sh
+# Local multi-instance setup for message sharding.
+#   tools/shards_local.sh start [N]   init (first run) and start N shard instances on ports 5441..
+#   tools/shards_local.sh stop [N]
+# Needs initdb/pg_ctl/psql on PATH. Data lives in $SHARD_ROOT (default /tmp/icq-shards).
+set -e
+
+ACTION=${1:-start}
+COUNT=${2:-3}
+ROOT=${SHARD_ROOT:-/tmp/icq-shards}
+BASE_PORT=${SHARD_BASE_PORT:-5440}
+SCHEMA="$(dirname "$0")/shard_schema.sql"
+
+urls=""
+i=1
+while [ "$i" -le "$COUNT" ]; do
+  dir="$ROOT/shard$i"
+  port=$((BASE_PORT + i))
+  dsn="postgresql://$(whoami)@localhost:$port/postgres"
+
+  if [ "$ACTION" = "stop" ]; then
+    pg_ctl -D "$dir" stop -m fast || true
+  else
+    if [ ! -d "$dir" ]; then
+      initdb -D "$dir" -A trust >/dev/null
+    fi
+    pg_ctl -D "$dir" -o "-p $port" -l "$dir.log" -w start >/dev/null
+    psql "$dsn" -q -v ON_ERROR_STOP=1 -v shard_no="$i" -f "$SCHEMA"
+    urls="${urls:+$urls,}$i=$dsn"
+  fi
+  i=$((i + 1))
+done
+
+if [ "$ACTION" != "stop" ]; then
+  echo "export MESSAGE_SHARD_URLS=\"$urls\""
+fi